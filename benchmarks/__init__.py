@@ -0,0 +1,10 @@
+"""
+    This package contains micro-benchmarks for the hot paths of switch.py.
+    Each module can be run from the root of the repository, e.g.::
+
+        python -m benchmarks.schedule_lookup
+"""
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
@@ -0,0 +1,78 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Measures the time taken to authenticate a request carrying basic auth credentials, when the SHA256 hash of the
+    password is computed and compared on each request as it used to be, and when the Authorization header is looked up
+    in the cache of the BasicAuthenticator. Both the checks alone and whole requests to a Flask app are measured.
+"""
+
+import hashlib
+import timeit
+from base64 import b64encode
+
+from flask import Flask, Response, request
+
+from switch.auth import BasicAuthenticator
+
+USER, PASSWORD = 'admin', 'admin'
+PASSWORD_HASH = hashlib.sha256(PASSWORD.encode()).hexdigest()
+HEADER = 'Basic ' + b64encode(('%s:%s' % (USER, PASSWORD)).encode()).decode()
+
+
+def baseline_check(user, password):
+    """ The previous check_auth of the app. """
+    return user == USER and hashlib.sha256(password.encode()).hexdigest() == PASSWORD_HASH
+
+
+def create_app(ensure_auth):
+    app = Flask(__name__)
+    app.before_request(ensure_auth)
+    app.add_url_rule('/', 'index', lambda: '')
+    return app
+
+
+def baseline_ensure_auth():
+    auth = request.authorization
+    if not auth or not baseline_check(auth.username, auth.password):
+        return Response(status=401)
+
+
+def create_cached_ensure_auth(authenticator):
+    def ensure_auth():
+        header = request.headers.get('Authorization')
+        if authenticator.is_verified(header):
+            return
+        auth = request.authorization
+        if not auth or not authenticator.check(auth.username, auth.password, header):
+            return Response(status=401)
+    return ensure_auth
+
+
+def measure(name, function, number):
+    elapsed = timeit.timeit(function, number=number)
+    print('  %-26s %8.2f us' % (name, elapsed / number * 1e6))
+
+
+def main(number=200000, requests=20000):
+    authenticator = BasicAuthenticator(USER, PASSWORD_HASH)
+    uncached = BasicAuthenticator(USER, PASSWORD_HASH, cache_ttl=0)
+    authenticator.check(USER, PASSWORD, HEADER)
+    print('checks:')
+    measure('baseline', lambda: baseline_check(USER, PASSWORD), number)
+    measure('verification', lambda: uncached.check(USER, PASSWORD, HEADER), number)
+    measure('cached header', lambda: authenticator.is_verified(HEADER), number)
+
+    print('requests:')
+    for name, ensure_auth in (('baseline', baseline_ensure_auth),
+                              ('verification', create_cached_ensure_auth(uncached)),
+                              ('cached header', create_cached_ensure_auth(authenticator))):
+        client = create_app(ensure_auth).test_client()
+        assert client.get('/', headers={'Authorization': HEADER}).status_code == 200
+        measure(name, lambda: client.get('/', headers={'Authorization': HEADER}), requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Compares the latency of SwitchManager.set_levels for relays spread over a few stand-in relay boards, driven either
+    by on and off functions opening a connection per switch, as a function-based module would, or by the tcp_relay
+    driver keeping its connections open and sending one command per board.
+"""
+
+import socket
+import time
+from collections import OrderedDict
+from importlib import import_module
+
+from benchmarks.relay_server import RelayServer
+from switch.persistence import SQLiteStateStore
+from switch.switch_manager import SwitchManager
+
+# The previous function-based way, this module being used as the switch module: one connection per actuation.
+relays = {}
+
+
+def _send(switch, level):
+    controller, relay = relays[switch]
+    host, port = controller.rsplit(':', 1)
+    with socket.create_connection((host, int(port)), timeout=5) as connection:
+        connection.sendall(b'SET %s=%d\n' % (relay.encode(), level))
+        assert connection.makefile('rb').readline().strip() == b'OK'
+
+
+def on(switch, level=1):
+    _send(switch, level)
+
+
+def off(switch):
+    _send(switch, 0)
+
+
+def build_manager(module, servers, switches):
+    # The manager imports this module by its name, which is another module object than __main__.
+    functions = import_module('benchmarks.driver_latency')
+    definitions = OrderedDict()
+    for i in range(switches):
+        server = servers[i % len(servers)]
+        switch = 'relay-%d' % i
+        definitions[switch] = {'module': module, 'name': 'Relay %d' % i, 'levels': 1,
+                               'controller': server.controller, 'relay': str(i)}
+        functions.relays[switch] = server.controller, str(i)
+    return SwitchManager(definitions, state_store=SQLiteStateStore(':memory:'))
+
+
+def main(switches=64, controllers=4, latency=0.002, rounds=20):
+    print('%d relays on %d boards, %.1f ms per command' % (switches, controllers, latency * 1e3))
+    for name, module in (('functions', 'benchmarks.driver_latency'), ('tcp_relay', 'tcp_relay')):
+        servers = [RelayServer(latency=latency).start() for _ in range(controllers)]
+        manager = build_manager(module, servers, switches)
+        ids = list(manager._switches)
+        connections = sum(server.connections for server in servers)
+        commands = sum(server.commands for server in servers)
+        elapsed = time.perf_counter()
+        for i in range(rounds):
+            results = manager.set_levels({switch: (i + 1) % 2 for switch in ids})
+            assert not any(results.values()), results
+        elapsed = (time.perf_counter() - elapsed) / rounds
+        assert all(server.levels == {str(j): rounds % 2 for j in range(k, switches, controllers)}
+                   for k, server in enumerate(servers))
+        print('%-10s set_levels: %7.2f ms  connections: %4d  commands: %4d' % (
+            name, elapsed * 1e3, sum(server.connections for server in servers) - connections,
+            sum(server.commands for server in servers) - commands))
+        manager.flush()
+        manager.__del__()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Compares the write and read throughputs of the JSON lines and binary formats of the frontend log segments.
+    The number of records can be given as argument.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from switch.log import JsonLinesFormat, BinaryFormat
+
+
+def main(records=200000):
+    start = datetime(2017, 1, 1)
+    log_records = [(start + timedelta(minutes=i), 'switch-%d' % (i % 40),
+                    'Switch was set to <small>Keep ON</small> by IP 192.168.1.%d' % (i % 256)) for i in range(records)]
+    with tempfile.TemporaryDirectory() as directory:
+        print('%d records' % records)
+        for segment_format in (JsonLinesFormat(), BinaryFormat(os.path.join(directory, 'contexts'))):
+            path = os.path.join(directory, 'segment' + os.extsep + segment_format.extension)
+            begin = time.perf_counter()
+            with open(path, 'wb') as f:
+                for record in log_records:
+                    f.write(segment_format.encode(record))
+            write_time = time.perf_counter() - begin
+
+            begin = time.perf_counter()
+            with open(path, 'rb') as f:
+                data = f.read()
+            offsets, _ = segment_format.index(data)
+            index_time = time.perf_counter() - begin
+            begin = time.perf_counter()
+            decoded = segment_format.decode(data)
+            read_time = time.perf_counter() - begin
+            assert len(decoded) == len(offsets) == records and decoded[-1][1:] == log_records[-1][1:]
+
+            print('%-15s %6.1f MB  write: %9.0f records/s  index: %10.0f records/s  read: %9.0f records/s' % (
+                type(segment_format).__name__, len(data) / 1e6, records / write_time, records / index_time, records / read_time))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,92 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Measures the startup time of the frontend log on a synthetic log of one million records, when decoding every
+    record as FrontendHandler used to do and when loading the FrontendLogStore tail-first.
+    The number of records can be given as argument.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from switch.log import FrontendLogStore
+from switch.utils import DateTimeEncoder, DateTimeDecoder
+
+
+def write_log(path, records):
+    start = datetime(2017, 1, 1)
+    with open(path, 'w') as f:
+        for i in range(records):
+            record = (start + timedelta(minutes=i), 'circulator', 'Switch was set to <small>Keep ON</small> by IP '
+                                                                 '192.168.1.%d' % (i % 256))
+            json.dump(record, f, cls=DateTimeEncoder)
+            f.write('\n')
+
+
+def load_everything(path):
+    records = []
+    with open(path, 'r') as f:
+        for line in f.readlines():
+            records.append(json.loads(line, cls=DateTimeDecoder))
+    return records
+
+
+def main(records=1000000):
+    directory = tempfile.mkdtemp()
+    try:
+        legacy_path = os.path.join(directory, 'frontend_logs.data')
+        write_log(legacy_path, records)
+        max_size = 2 * os.path.getsize(legacy_path)  # Keeps the whole log
+        print('Synthetic log of %d records, %.1f MB' % (records, max_size / 2e6))
+
+        start = time.perf_counter()
+        load_everything(legacy_path)
+        full_time = time.perf_counter() - start
+        print('Decoding every record:          %8.3f s' % full_time)
+
+        start = time.perf_counter()
+        store = FrontendLogStore(os.path.join(directory, 'segments'), max_size=max_size,
+                                 legacy_path=legacy_path)
+        first_time = time.perf_counter() - start
+        store.close()
+        print('Tail-first load, first startup: %8.3f s (%.3f s saved)' % (first_time, full_time - first_time))
+
+        start = time.perf_counter()
+        store = FrontendLogStore(os.path.join(directory, 'segments'), max_size=max_size)
+        next_time = time.perf_counter() - start
+        print('Tail-first load, next startups: %8.3f s (%.3f s saved)' % (next_time, full_time - next_time))
+
+        start = time.perf_counter()
+        assert len(store.get(50, before=records // 2)) == 50
+        print('First page of older records:    %8.3f s' % (time.perf_counter() - start))
+        start = time.perf_counter()
+        store.get(50, before=records // 4)
+        print('Next page of older records:     %8.3f s' % (time.perf_counter() - start))
+        store.close()
+
+        # With the default max_size, a larger log is compacted to its most recent records rather than removed.
+        legacy_path = os.path.join(directory, 'default', 'frontend_logs.data')
+        os.makedirs(os.path.dirname(legacy_path))
+        write_log(legacy_path, records)
+        start = time.perf_counter()
+        store = FrontendLogStore(os.path.join(directory, 'default', 'segments'), legacy_path=legacy_path)
+        compact_time = time.perf_counter() - start
+        page = store.get(50)
+        assert [seq for seq, _ in page] == list(range(records - 50, records)), 'The most recent records were lost'
+        kept = records - store._segments[0][0]
+        print('First startup, default max_size: %7.3f s (%d records kept)' % (compact_time, kept))
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
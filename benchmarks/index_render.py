@@ -0,0 +1,97 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Measures the rendering time of the index page for 500 switches and 50 log records, when SwitchManager builds a
+    new dict for each access to a switch as it used to do, and when it serves the cached snapshots of the switches.
+    The time spent in the accessors alone is also measured. The number of switches can be given as argument.
+"""
+
+import sys
+import timeit
+from collections import OrderedDict
+
+from flask import Flask, Blueprint, render_template
+
+from switch import join_root
+from switch.persistence import SQLiteStateStore
+from switch.switch_manager import SwitchManager
+from switch.time.schedule import Schedule
+from switch.time.time_interval import WeightedTimeInterval, Instant
+
+
+class UncachedSwitchManager(SwitchManager):
+    """ The previous implementation of the SwitchManager accessors, building a new dict on each access. """
+
+    def __getitem__(self, switch_id):
+        attrs = self._switches.get(switch_id)
+        if not attrs:
+            return None
+        switch_dict = {'id': switch_id, 'name': attrs['name'], 'levels': attrs['levels'],
+                       'schedules': self._schedules[switch_id]}
+        switch_dict.update(self._states[switch_id])
+        active_schedule = switch_dict.get('active_schedule')
+        if active_schedule and switch_dict['mode'] < 3:
+            next_action = self._schedules[switch_id][active_schedule].get_next_action()
+            if next_action:
+                level, date = next_action
+                switch_dict['next_action'] = (level or 0, date)
+        return switch_dict
+
+    def __contains__(self, item):
+        return self[item] is not None
+
+
+def create_app():
+    """ Returns an app rendering the templates of switch.py, with the endpoints they link to. """
+    app = Flask(__name__, template_folder=join_root('templates'))
+    bower = Blueprint('bower', __name__)
+    bower.add_url_rule('/bower/<path:filename>', 'static', lambda filename: '')
+    app.register_blueprint(bower)
+    app.add_url_rule('/', 'index', lambda: '')
+    app.add_url_rule('/configuration/<switch>', 'get_configure_switch', lambda switch: '')
+    app.add_url_rule('/switch/<switch>/mode/<int:mode>', 'switch_mode', lambda switch, mode: '')
+    app.add_url_rule('/switch/<switch>/use/<schedule>', 'use_switch_schedule', lambda switch, schedule: '')
+    return app
+
+
+def create_switch_manager(cls, switches):
+    definitions = OrderedDict(('switch-%d' % i, {'module': 'example_switch', 'name': 'Switch %d' % i, 'levels': 1 + i % 3})
+                              for i in range(switches))
+    manager = cls(definitions, state_store=SQLiteStateStore(':memory:'))
+    office_hours = Schedule([WeightedTimeInterval(Instant(day, 8, 0), Instant(day, 18, 0), w=1) for day in range(5)])
+    for switch in definitions:
+        manager.add_schedule(switch, 'Office hours', office_hours)
+        manager.use_schedule(switch, 'Office hours')
+    return manager
+
+
+def main(switches=500, number=10):
+    app = create_app()
+    print('Rendering index.html with %d switches' % switches)
+    for cls in (UncachedSwitchManager, SwitchManager):
+        manager = create_switch_manager(cls, switches)
+        # The same lookups as the get_context_name function of the frontend handler, for each displayed log record
+        contexts = ['switch-%d' % (i * 7 % switches) for i in range(50)]
+
+        def get_logs():
+            return [(i, manager[x]['name'] if x in manager else x.title(), 'Message', 'just now', '')
+                    for i, x in enumerate(contexts)]
+
+        def access():
+            return [(switch['id'], switch.get('next_action')) for switch in manager], get_logs()
+
+        with app.test_request_context('/'):
+            def render():
+                return render_template('index.html', switch_manager=manager, logs=get_logs(), logs_before=None,
+                                       logs_first=0)
+            render()
+            print('%-21s render: %8.2f ms  accessors: %8.2f ms' % (
+                cls.__name__, timeit.timeit(render, number=number) * 1000 / number,
+                timeit.timeit(access, number=number) * 1000 / number))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
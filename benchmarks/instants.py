@@ -0,0 +1,106 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Measures the comparisons and conversions per second of the integer-minute Instant and intervals, compared with the
+    previous implementation of Instant as a timedelta subclass.
+"""
+
+import random
+import timeit
+from datetime import timedelta, date, datetime, time
+
+from switch.time.time_interval import WeightedTimeInterval, Instant
+
+
+class TimedeltaInstant(timedelta):
+    """ The previous implementation of Instant, a timedelta compared through isinstance dispatch. """
+
+    def __new__(cls, day=0, hour=0, minute=0):
+        return super().__new__(cls, days=day % 8, hours=hour, minutes=minute)
+
+    def __lt__(self, other):
+        if isinstance(other, TimedeltaInterval):
+            return self < other.a
+        if isinstance(other, TimedeltaInstant):
+            return super().__lt__(other)
+        return NotImplemented
+
+    def __le__(self, other):
+        if isinstance(other, TimedeltaInterval):
+            return self <= other.a
+        if isinstance(other, TimedeltaInstant):
+            return super().__le__(other)
+        return NotImplemented
+
+    def to_datetime(self):
+        today = date.today()
+        week_start = datetime.combine(today - timedelta(days=today.weekday()), time())
+        return week_start + self
+
+    def to_dict(self):
+        return {'day': self.days, 'hour': self.seconds // (60 * 60), 'minute': (self.seconds // 60) % 60}
+
+    @classmethod
+    def now_to_instant(cls):
+        today = date.today()
+        week_start = datetime.combine(today - timedelta(days=today.weekday()), time())
+        delta = datetime.now() - week_start
+        return cls(day=delta.days, hour=delta.seconds // (60 * 60), minute=(delta.seconds // 60) % 60)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+
+class TimedeltaInterval(object):
+    """ The previous implementation of the intervals, compared through their bounds. """
+
+    def __init__(self, a, b, w=0):
+        assert a <= b
+        self.a = a
+        self.b = b
+        self.weight = w
+
+    def __contains__(self, item):
+        if isinstance(item, TimedeltaInterval):
+            return self.a <= item.a and self.b >= item.b
+        if isinstance(item, TimedeltaInstant):
+            return self.a <= item <= self.b
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, TimedeltaInterval):
+            return self.b < other.a
+        return NotImplemented
+
+
+def measure(name, function, number):
+    elapsed = timeit.timeit(function, number=1)
+    print('  %-22s %12.0f per second' % (name, number / elapsed))
+
+
+def main(number=100000):
+    random.seed(42)
+    minutes = [random.randrange(7 * 24 * 60) for _ in range(number + 1)]
+    for name, instant_class, interval_class in (('timedelta', TimedeltaInstant, TimedeltaInterval),
+                                                ('integer minutes', Instant, WeightedTimeInterval)):
+        instants = [instant_class(minute=m) for m in minutes]
+        pairs = list(zip(instants, instants[1:]))
+        intervals = [interval_class(min(a, b), max(a, b), 1) for a, b in pairs]
+        interval_pairs = list(zip(intervals, intervals[1:]))
+        dicts = [i.to_dict() for i in instants]
+        print('%s:' % name)
+        measure('instant <', lambda: [a < b for a, b in pairs], number)
+        measure('interval <', lambda: [a < b for a, b in interval_pairs], number)
+        measure('instant in interval', lambda: [a in i for a, i in zip(instants, intervals)], number)
+        measure('to_datetime', lambda: [i.to_datetime() for i in instants], number)
+        measure('now_to_instant', lambda: [instant_class.now_to_instant() for _ in range(number)], number)
+        measure('to_dict', lambda: [i.to_dict() for i in instants], number)
+        measure('from_dict', lambda: [instant_class.from_dict(d) for d in dicts], number)
+
+
+if __name__ == '__main__':
+    main()
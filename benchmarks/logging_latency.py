@@ -0,0 +1,76 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Measures the time taken by the scheduler to handle an event in virtual time when the app log is written by a
+    FileHandler in the calling thread, as it used to be, through the BackgroundHandler, or not written at all.
+    Each write to the log file is slowed down by the given disk latency, as with a slow SD card.
+"""
+
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.simulation import build_manager
+from switch.log import app_logger, BackgroundHandler
+from switch.time.clock import SimulatedClock, set_clock
+
+
+class SlowFileHandler(logging.FileHandler):
+    def __init__(self, filename, latency):
+        super().__init__(filename)
+        self.latency = latency
+        self.setFormatter(logging.Formatter('%(asctime)s - %(module)s - [%(context)s] - %(levelname)s - %(message)s'))
+
+    def flush(self):
+        super().flush()
+        time.sleep(self.latency)
+
+
+def replay(switches, days, level, handler):
+    clock = SimulatedClock(datetime(2017, 1, 2))
+    set_clock(clock)
+    previous_handlers, previous_level = app_logger.handlers, app_logger.level
+    app_logger.handlers = [handler]
+    app_logger.setLevel(level)
+    try:
+        manager = build_manager(switches)
+        end = clock.now() + timedelta(days=days)
+        events = len({date for date, _, _ in manager.forecast(clock.now(), end)})
+        elapsed = time.perf_counter()
+        manager.scheduler.run_until(end.timestamp())
+        elapsed = time.perf_counter() - elapsed
+        drained = time.perf_counter()
+        if isinstance(handler, BackgroundHandler):
+            handler.stop()
+        drained = time.perf_counter() - drained
+        manager.__del__()
+    finally:
+        app_logger.handlers, app_logger.level = previous_handlers, previous_level
+        handler.close()
+    return events, elapsed, drained
+
+
+def main(switches=200, days=7, disk_latency=0.0002):
+    directory = tempfile.mkdtemp()
+    print('%d switches, %d days, %.1f ms per write to the log file' % (switches, days, disk_latency * 1e3))
+    variants = [
+        ('disabled', logging.WARNING, lambda path: BackgroundHandler(SlowFileHandler(path, disk_latency))),
+        ('file', logging.DEBUG, lambda path: SlowFileHandler(path, disk_latency)),
+        ('queued', logging.DEBUG, lambda path: BackgroundHandler(SlowFileHandler(path, disk_latency))),
+        ('queued info', logging.INFO, lambda path: BackgroundHandler(SlowFileHandler(path, disk_latency))),
+    ]
+    for name, level, make_handler in variants:
+        path = os.path.join(directory, name.replace(' ', '_') + '.log')
+        events, elapsed, drained = replay(switches, days, level, make_handler(path))
+        print('%-12s %8.1f us per event  (%d events, log of %d KiB written %.2f s after the replay)' % (
+            name, elapsed / events * 1e6, events, os.path.getsize(path) // 1024 if os.path.exists(path) else 0,
+            drained))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    A stand-in for a relay board speaking the line protocol of the tcp_relay driver, to try the driver without the
+    hardware. Each ``SET relay=level ...`` command is answered by ``OK`` after the given latency, e.g.::
+
+        python -m benchmarks.relay_server --port 5000 --latency 0.002
+"""
+
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+class RelayHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.clients.add(self.connection)
+        try:
+            self._handle_commands()
+        finally:
+            with self.server.lock:
+                self.server.clients.discard(self.connection)
+
+    def _handle_commands(self):
+        for line in self.rfile:
+            command, _, arguments = line.decode().strip().partition(' ')
+            if command != 'SET' or not arguments:
+                self.wfile.write(b'ERROR unknown command\n')
+                continue
+            try:
+                levels = {relay: int(level) for relay, level in (a.split('=', 1) for a in arguments.split())}
+            except ValueError:
+                self.wfile.write(b'ERROR invalid level\n')
+                continue
+            time.sleep(self.server.latency)
+            if self.server.failure:
+                self.wfile.write(self.server.failure.encode() + b'\n')
+                continue
+            with self.server.lock:
+                self.server.levels.update(levels)
+                self.server.commands += 1
+            self.wfile.write(b'OK\n')
+
+
+class RelayServer(socketserver.ThreadingTCPServer):
+    """
+        A relay board keeping the level of each relay, and counting the connections and commands it received.
+        Setting failure to a message makes it answer every command with it instead of switching the relays.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        super().__init__(address, RelayHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.levels = {}
+        self.connections = 0
+        self.commands = 0
+        self.failure = None
+        self.clients = set()
+
+    @property
+    def controller(self):
+        return '%s:%d' % self.server_address[:2]
+
+    def close_connections(self):
+        """ Closes the connections of the clients, as a board does with the ones idle for too long. """
+        with self.lock:
+            for client in self.clients:
+                client.shutdown(socket.SHUT_RDWR)
+
+    def start(self):
+        """ Serves in a background thread and returns the server. """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds taken by the board to switch its relays.')
+    args = parser.parse_args()
+    server = RelayServer((args.host, args.port), args.latency)
+    print('Relay board listening on %s' % server.controller)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
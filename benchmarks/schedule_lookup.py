@@ -0,0 +1,92 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Compares the lookups of Schedule, bisecting into its interval index and transition table, with the linear scan
+    they replaced, on a schedule made of 15-minute slots alternating between two levels and gaps.
+"""
+
+import random
+import timeit
+from datetime import timedelta
+
+from switch.time.schedule import Schedule
+from switch.time.time_interval import WeightedTimeInterval, Instant, WEEK_MINUTES
+
+
+class LinearScanSchedule(Schedule):
+    """ The previous implementation of the Schedule lookups, scanning every interval. """
+
+    def get_weight(self, i: Instant):
+        for interval in self._intervals:
+            if i in interval:
+                return interval.weight
+        return None
+
+    def get_current_action(self):
+        if not self._intervals:
+            return None
+
+        now = Instant.now_to_instant()
+        for idx, interval in enumerate(self._intervals):
+            if now in interval:
+                return interval.weight, interval.a.to_datetime()
+            if now < interval:
+                previous_idx = (idx - 1) % len(self._intervals)
+                previous_instant = self._intervals[previous_idx].b.to_datetime()
+                if previous_idx > idx:
+                    previous_instant -= timedelta(weeks=1)
+                return None, previous_instant
+        return None, self._intervals[-1].b.to_datetime()
+
+    def get_next_action(self):
+        if not self._intervals:
+            return None
+
+        now = Instant.now_to_instant()
+        for idx, interval in enumerate(self._intervals):
+            if now < interval:
+                return interval.weight, interval.a.to_datetime()
+            next_interval = self._intervals[(idx + 1) % len(self._intervals)]
+            if interval == next_interval:
+                next_interval = WeightedTimeInterval(Instant.from_minutes(interval.start + WEEK_MINUTES),
+                                                     Instant.from_minutes(interval.end + WEEK_MINUTES), interval.weight)
+            if now in interval and interval.b < next_interval.a:
+                return None, interval.b.to_datetime()
+
+        if self.get_current_action()[0] is None:
+            return self._intervals[0].weight, self._intervals[0].a.to_datetime() + timedelta(weeks=1)
+        return None, self._intervals[-1].b.to_datetime()
+
+
+def build_intervals(slots=672):
+    """ Returns intervals covering one 15-minute slot out of two, with a gap every third interval. """
+    intervals = []
+    for slot in range(0, slots - 1, 2):
+        if slot % 3:
+            intervals.append(WeightedTimeInterval(Instant(minute=15 * slot), Instant(minute=15 * (slot + 1)),
+                                                  w=1 + slot % 2))
+    return intervals
+
+
+def main(number=2000):
+    intervals = build_intervals()
+    random.seed(42)
+    instants = [Instant(minute=random.randrange(7 * 24 * 60)) for _ in range(number)]
+    schedules = {'linear scan': LinearScanSchedule(intervals), 'bisect': Schedule(intervals)}
+
+    print('Schedule with %d intervals, %d lookups per measure' % (len(intervals), number))
+    for name, schedule in schedules.items():
+        assert [schedule.get_weight(i) for i in instants] == [Schedule.get_weight(schedules['linear scan'], i)
+                                                              for i in instants]
+        weight = timeit.timeit(lambda: [schedule.get_weight(i) for i in instants], number=1)
+        current = timeit.timeit(schedule.get_current_action, number=number)
+        next_action = timeit.timeit(schedule.get_next_action, number=number)
+        print('%-14s get_weight: %8.2f us  get_current_action: %8.2f us  get_next_action: %8.2f us' % (
+            name, weight * 1e6 / number, current * 1e6 / number, next_action * 1e6 / number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Compares the interval-based Schedule with the slot-array SlotSchedule when building a schedule from the interface
+    list sent by the web UI, loading it from its dict, compiling its transition table and looking up levels.
+"""
+
+import random
+import timeit
+
+from switch.time.schedule import Schedule, SlotSchedule
+from switch.time.time_interval import WeightedTimeInterval, Instant
+
+
+def build_interface_list(slots=672):
+    """ Returns [start, end, level] intervals covering one 15-minute slot out of two, with a gap every third one. """
+    return [[slot, slot + 1, 1 + slot % 2] for slot in range(0, slots - 1, 2) if slot % 3]
+
+
+def build_schedule(interface_list):
+    return Schedule([WeightedTimeInterval(Instant(minute=15 * a), Instant(minute=15 * b), w=l)
+                     for a, b, l in interface_list])
+
+
+def compile_transitions(schedule):
+    schedule._transitions = None
+    schedule._get_transitions()
+
+
+def main(number=200):
+    interface_list = build_interface_list()
+    random.seed(42)
+    instants = [Instant(minute=random.randrange(7 * 24 * 60)) for _ in range(10000)]
+    schedule_dict = build_schedule(interface_list).to_dict()
+    variants = {
+        'intervals': (lambda: build_schedule(interface_list), lambda: Schedule.from_dict(schedule_dict)),
+        'slots': (lambda: SlotSchedule.from_interface_list(interface_list),
+                  lambda: SlotSchedule.from_dict(schedule_dict)),
+    }
+
+    print('Schedule with %d intervals' % len(interface_list))
+    for name, (build, load) in variants.items():
+        schedule = build()
+        assert schedule.to_dict() == schedule_dict
+        build_time = timeit.timeit(build, number=number) / number
+        load_time = timeit.timeit(load, number=number) / number
+        compile_time = timeit.timeit(lambda: compile_transitions(schedule), number=number) / number
+        weight_time = timeit.timeit(lambda: [schedule.get_weight(i) for i in instants], number=1) / len(instants)
+        print('%-10s build: %9.1f us  from_dict: %9.1f us  transitions: %7.1f us  get_weight: %5.2f us' % (
+            name, build_time * 1e6, load_time * 1e6, compile_time * 1e6, weight_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    Replays a month of scheduled transitions for thousands of switches in virtual time, with a SimulatedClock and the
+    simulation scheduler, and reports the number of transitions handled per second.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from switch.persistence import SQLiteStateStore
+from switch.switch_manager import SwitchManager
+from switch.time.clock import SimulatedClock, set_clock
+from switch.time.schedule import SlotSchedule
+
+
+def build_manager(switches):
+    definitions = OrderedDict(('switch-%d' % i, {'module': 'example_switch', 'name': 'Switch %d' % i, 'levels': 3})
+                              for i in range(switches))
+    manager = SwitchManager(definitions, scheduler='simulation', state_store=SQLiteStateStore(':memory:'))
+    operations = []
+    for i, switch in enumerate(definitions):
+        # Office hours shifted by a quarter of an hour for each switch, at two levels.
+        shift = i % 16
+        intervals = [[day * 96 + 28 + shift, day * 96 + 48 + shift, 1 + i % 2] for day in range(5)]
+        intervals += [[day * 96 + 52 + shift, day * 96 + 72 + shift, 2 - i % 2] for day in range(5)]
+        operations.append((switch, 'add', 'office', SlotSchedule.from_interface_list(intervals)))
+        operations.append((switch, 'activate', 'office', None))
+    manager.update_schedules(operations)
+    return manager
+
+
+def main(switches=2000, days=30):
+    start = datetime(2017, 1, 2)
+    end = start + timedelta(days=days)
+    clock = SimulatedClock(start)
+    set_clock(clock)
+    manager = build_manager(switches)
+    expected = sum(1 for _ in manager.forecast(clock.now(), end))
+
+    elapsed = time.perf_counter()
+    manager.scheduler.run_until(end.timestamp())
+    elapsed = time.perf_counter() - elapsed
+
+    for switch in manager:
+        schedule = switch['schedules']['office']
+        assert switch['level'] == (schedule.get_current_action()[0] or 0), switch['id']
+    print('%d switches, %d days: %d transitions replayed in %.2f s, %.0f transitions per second' % (
+        switches, days, expected, elapsed, expected / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import asyncio
+import math
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from threading import Lock
+
+from switch.log import app_logger as logger
+from switch.metrics import registry, actuation_seconds
+
+
+class ActuationTimeout(Exception):
+    pass
+
+
+class Actuator(object):
+    """
+        Dispatches the actuations of switches to a bounded pool of worker threads.
+        Each call is given timeout seconds to complete once started, so that a hung switch does not stall the others.
+        Calls waiting for a worker are never timed out. As a hung call keeps its worker, a new pool of workers replaces
+        the current one once all of its workers are held by calls which timed out, the calls still waiting being moved
+        to the new pool.
+        Coroutine functions are run on the given asyncio loop if any, or in a worker thread otherwise.
+
+        >>> import threading
+        >>> release = threading.Event()
+        >>> levels = {}
+        >>> def set_level(switch, level):
+        ...     levels[switch] = level
+        >>> async def set_level_async(switch, level):
+        ...     await asyncio.sleep(0.01)
+        ...     levels[switch] = level
+        >>> actuator = Actuator(workers=2, timeout=5)
+        >>> results = actuator.actuate([('kitchen', set_level, ('kitchen', 1)), ('garden', set_level, ('garden', 0)),
+        ...                             ('hall', set_level_async, ('hall', 1))])
+        >>> sorted(results.items())
+        [('garden', None), ('hall', None), ('kitchen', None)]
+        >>> sorted(levels.items())
+        [('garden', 0), ('hall', 1), ('kitchen', 1)]
+        >>> actuator.shutdown()
+
+        A hung call does not prevent the calls queued behind it from running:
+
+        >>> logger.disabled = True  # Timeouts are reported in the app log.
+        >>> actuator = Actuator(workers=1, timeout=0.1)
+        >>> results = actuator.actuate([('cellar', release.wait, ()), ('kitchen', set_level, ('kitchen', 0))])
+        >>> type(results['cellar']).__name__, results['kitchen'], levels['kitchen']
+        ('ActuationTimeout', None, 0)
+        >>> actuator.actuate([('garden', set_level, ('garden', 1))])
+        {'garden': None}
+        >>> release.set()
+        >>> actuator.shutdown()
+        >>> logger.disabled = False
+    """
+
+    def __init__(self, workers=4, timeout=10, loop=None):
+        self._workers = workers
+        self._timeout = timeout
+        self._loop = loop
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='switch.py-actuator')
+        self._hung = set()  # The futures of the calls of the current executor still running after timing out
+
+    def actuate(self, actuations):
+        """
+            Runs each function of the list of tuples (switch, function, args) and collects their results as they
+            finish. Returns a dict associating each switch with None if its actuation succeeded, or with the exception
+            raised otherwise. Failures and timeouts are reported in the app log.
+        """
+        started = {}  # Futures whose result is the time at which the call of each switch started
+        futures = {}
+        for switch, function, args in actuations:
+            started[switch] = Future()
+            futures[self._submit(started[switch], function, args)] = (switch, function, args)
+
+        results = {}
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            for future in [f for f in pending if started[futures[f][0]].done() and
+                           started[futures[f][0]].result() + self._timeout <= now]:
+                switch = futures[future][0]
+                pending.remove(future)
+                if not future.cancel():
+                    self._abandon(future)
+                results[switch] = ActuationTimeout('No response after %d seconds' % self._timeout)
+                logger.error('Actuation timed out after %d seconds', self._timeout, extra=dict(context=switch))
+            if not pending:
+                break
+            if len(self._hung) >= self._workers:
+                self._replace_executor(pending, futures, started)
+            deadlines = [started[futures[f][0]].result() + self._timeout for f in pending
+                         if started[futures[f][0]].done()]
+            # Waiting for calls to start as well, since their deadlines only begin then.
+            starting = {started[futures[f][0]] for f in pending if not started[futures[f][0]].done()}
+            timeout = max(min(deadlines) - now, 0) if deadlines else None
+            done, _ = wait(pending | starting, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done & pending:
+                pending.remove(future)
+                switch = futures[future][0]
+                results[switch] = future.exception()
+                if results[switch] is not None:
+                    logger.error('Actuation failed', exc_info=results[switch], extra=dict(context=switch))
+        return results
+
+    def _submit(self, started, function, args):
+        if asyncio.iscoroutinefunction(function) and self._loop is not None:
+            started.set_result(time.monotonic())
+            future = asyncio.run_coroutine_threadsafe(function(*args), self._loop)
+        else:
+            future = self._executor.submit(self._run, started, function, args)
+        if registry.enabled:
+            future.add_done_callback(partial(self._observe, started, function))
+        return future
+
+    def _abandon(self, future):
+        with self._lock:
+            hung = self._hung
+            hung.add(future)
+        future.add_done_callback(hung.discard)
+
+    def _replace_executor(self, pending, futures, started):
+        """ Replaces the executor whose workers all hang, moving the calls which did not start to the new one. """
+        with self._lock:
+            executor = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='switch.py-actuator')
+            self._hung = set()
+        logger.warning('Replacing the %d hung actuation workers', self._workers, extra=dict(context='actuator'))
+        for future in list(pending):
+            switch, function, args = futures[future]
+            if not started[switch].done() and future.cancel():
+                pending.remove(future)
+                future = self._submit(started[switch], function, args)
+                futures[future] = (switch, function, args)
+                pending.add(future)
+        executor.shutdown(wait=False)
+
+    @staticmethod
+    def _observe(started, function, future):
+        if not future.cancelled() and started.done():
+            module = function.__module__
+            if module.startswith('switch.switches.'):
+                module = module[len('switch.switches.'):]
+            actuation_seconds.observe(time.monotonic() - started.result(), module, function.__name__)
+
+    @staticmethod
+    def _run(started, function, args):
+        started.set_result(time.monotonic())
+        if asyncio.iscoroutinefunction(function):
+            return asyncio.run(function(*args))
+        return function(*args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
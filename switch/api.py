@@ -0,0 +1,281 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import logging
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from switch.events import stream_events
+from switch.time.clock import get_clock
+from switch.time.schedule import SlotSchedule
+from switch.utils import mode_to_html, mode_to_name
+from switch.log import app_logger as logger
+
+api = Blueprint('api', __name__)
+frontend_logger = logging.getLogger('switch.py-frontend')
+# Versions restart at each run of the app, the tags of a previous run must not match.
+instance_tag = uuid.uuid4().hex[:8]
+
+
+def switch_to_json(switch):
+    """ Returns a JSON-serializable dict of the attributes, the state and the next action of the given snapshot. """
+    switch_json = {key: value for key, value in switch.items()
+                   if key not in ('schedules', 'schedule_templates', 'next_action')}
+    switch_json['mode_name'] = mode_to_name[switch['mode']]
+    switch_json['schedules'] = sorted(switch['schedules'])
+    switch_json['schedule_templates'] = dict(switch['schedule_templates'])
+    if 'next_action' in switch:
+        level, date = switch['next_action']
+        switch_json['next_action'] = {'level': level, 'date': date.isoformat()}
+    else:
+        switch_json['next_action'] = None
+    return switch_json
+
+
+def schedules_to_json(switch):
+    """ Returns a dict associating the names of the schedules of the given snapshot with their interface lists. """
+    return {name: schedule.to_interface_list() for name, schedule in switch['schedules'].items()}
+
+
+def make_etag(version):
+    return '%s-%d' % (instance_tag, version)
+
+
+def conditional_json(version, build):
+    """
+        Returns a JSON response of the data built by the build function, tagged with the given version.
+        When the client already holds this version, a 304 response is returned without building the data.
+    """
+    etag = make_etag(version)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+def error(status, message):
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+def switch_response(switch_id):
+    """ Returns the JSON response of a switch after a change, tagged with its new version. """
+    manager = current_app.switch_manager
+    response = jsonify(switch_to_json(manager[switch_id]))
+    response.set_etag(make_etag(manager.get_version(switch_id)))
+    return response
+
+
+@api.route('/switches')
+def get_switches():
+    manager = current_app.switch_manager
+    return conditional_json(manager.version, lambda: [switch_to_json(switch) for switch in manager])
+
+
+@api.route('/switches/<switch_id>')
+def get_switch(switch_id):
+    manager = current_app.switch_manager
+    if switch_id not in manager:
+        return error(404, 'Unknown switch %s' % switch_id)
+    return conditional_json(manager.get_version(switch_id), lambda: switch_to_json(manager[switch_id]))
+
+
+@api.route('/switches/<switch_id>/schedules')
+def get_switch_schedules(switch_id):
+    manager = current_app.switch_manager
+    if switch_id not in manager:
+        return error(404, 'Unknown switch %s' % switch_id)
+    return conditional_json(manager.get_version(switch_id), lambda: schedules_to_json(manager[switch_id]))
+
+
+@api.route('/switches/<switch_id>/mode', methods=['POST'])
+def post_switch_mode(switch_id):
+    """ Switches the mode of the switch, and its level for the modes keeping it on, e.g. {"mode": 1, "level": 2}. """
+    manager = current_app.switch_manager
+    if switch_id not in manager:
+        return error(404, 'Unknown switch %s' % switch_id)
+    body = request.get_json(silent=True) or {}
+    mode, level = body.get('mode'), body.get('level', 1)
+    if mode not in mode_to_name or isinstance(mode, bool):
+        return error(400, 'Invalid mode %r' % mode)
+    if not isinstance(level, int) or isinstance(level, bool) or not 0 < level <= manager[switch_id]['levels']:
+        return error(400, 'Invalid level %r' % level)
+
+    level = 0 if mode == 2 or mode == 4 else level
+    manager.switch_mode(switch_id, mode, level=level)
+    logger.info('New settings {mode=%d, level=%d}', mode, level, extra=dict(context=switch_id))
+    if manager[switch_id]['levels'] > 1 and mode not in [0, 2, 4]:
+        frontend_logger.info('Switch was set to <small>%s</small> at level %d by IP %s through the API',
+                             mode_to_html[mode], level, request.remote_addr, extra=dict(context=switch_id))
+    else:
+        frontend_logger.info('Switch was set to <small>%s</small> by IP %s through the API', mode_to_html[mode],
+                             request.remote_addr, extra=dict(context=switch_id))
+    return switch_response(switch_id)
+
+
+@api.route('/switches/<switch_id>/use/<schedule>', methods=['POST'])
+def post_switch_schedule(switch_id, schedule):
+    manager = current_app.switch_manager
+    if switch_id not in manager:
+        return error(404, 'Unknown switch %s' % switch_id)
+    if schedule not in manager[switch_id]['schedules']:
+        return error(404, 'Unknown schedule %s' % schedule)
+    manager.use_schedule(switch_id, schedule)
+    logger.info('Schedule %s is active', schedule, extra=dict(context=switch_id))
+    frontend_logger.info('Schedule %s was set as active through the API', schedule, extra=dict(context=switch_id))
+    return switch_response(switch_id)
+
+
+@api.route('/schedules', methods=['POST'])
+def post_schedules():
+    """
+        Applies a list of schedule operations to many switches at once, e.g. {"operations": [{"switches": ["a", "b"],
+        "action": "add", "name": "Office", "intervals": [[36, 72, 1]]}, {"switches": ["a"], "action": "activate",
+        "name": "Office"}]}, action being either add, replace or activate. A template may be given instead of the
+        intervals to add or replace, e.g. {"template": "Office hours"}. Returns the error of each switch, if any.
+    """
+    manager = current_app.switch_manager
+    body = request.get_json(silent=True) or {}
+    operations = []
+    try:
+        for operation in body['operations']:
+            action, name = operation['action'], operation['name']
+            if action not in ('add', 'replace'):
+                schedule = None
+            elif 'template' in operation:
+                schedule = str(operation['template'])
+            else:
+                # The schedule is shared by all the switches of the operation.
+                schedule = SlotSchedule.from_interface_list(operation['intervals']).freeze()
+            switches = operation['switches'] if 'switches' in operation else [operation['switch']]
+            if not isinstance(name, str) or not isinstance(switches, list) \
+                    or not all(isinstance(switch, str) for switch in switches):
+                raise TypeError('switches must be a list of switch ids and name a string')
+            operations.extend((switch, action, name, schedule) for switch in switches)
+    except (KeyError, TypeError, ValueError) as e:
+        return error(400, 'Invalid schedule operations: %r' % e)
+
+    results = manager.update_schedules(operations)
+    updated = [switch for switch, result in results.items() if result is None]
+    logger.info('Schedule operations were applied to %d switches and failed for %d', len(updated),
+                len(results) - len(updated), extra=dict(context='General'))
+    if updated:
+        frontend_logger.info('Schedules of %d switches were updated by IP %s through the API', len(updated),
+                             request.remote_addr, extra=dict(context='General'))
+    # The message of a KeyError is its first argument, str() would quote it.
+    return jsonify({switch: result if result is None else str(result.args[0] if result.args else result)
+                    for switch, result in results.items()})
+
+
+@api.route('/templates')
+def get_templates():
+    manager = current_app.switch_manager
+    return conditional_json(manager.version, lambda: {name: template.to_interface_list()
+                                                      for name, template in manager.get_templates().items()})
+
+
+@api.route('/templates/<template>', methods=['PUT'])
+def put_template(template):
+    """ Creates or replaces a template with the given intervals, e.g. {"intervals": [[36, 72, 1]]}. """
+    body = request.get_json(silent=True) or {}
+    try:
+        schedule = SlotSchedule.from_interface_list(body['intervals'])
+    except (KeyError, TypeError, ValueError) as e:
+        return error(400, 'Invalid template: %r' % e)
+    switches = current_app.switch_manager.set_template(template, schedule)
+    logger.info('Template %s was set, updating %d switches', template, len(switches), extra=dict(context='General'))
+    frontend_logger.info('Template %s was updated by IP %s through the API', template, request.remote_addr,
+                         extra=dict(context='General'))
+    return jsonify({'switches': switches})
+
+
+@api.route('/templates/<template>', methods=['DELETE'])
+def delete_template(template):
+    manager = current_app.switch_manager
+    if template not in manager.get_templates():
+        return error(404, 'Unknown template %s' % template)
+    try:
+        manager.delete_template(template)
+    except ValueError as e:
+        return error(409, str(e))
+    logger.info('Template %s was deleted', template, extra=dict(context='General'))
+    return jsonify({})
+
+
+def get_datetime_arg(name):
+    """
+        Returns the ISO 8601 query argument with the given name as a naive local datetime, the ones of the schedules,
+        or None if missing. Raises ValueError if it is invalid.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError('Invalid %s %s, an ISO 8601 date is expected' % (name, value))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def get_forecast_range():
+    """ Returns the start and end datetimes of the ISO 8601 query arguments, by default the next 7 days. """
+    start = get_datetime_arg('start') or get_clock().now()
+    end = get_datetime_arg('end') or start + timedelta(days=7)
+    if end < start:
+        raise ValueError('The end of the range precedes its start')
+    return start, end
+
+
+@api.route('/forecast')
+def get_forecast():
+    """ Lists at most limit transitions (date, switch, level) of the given switches, all by default, in time order. """
+    manager = current_app.switch_manager
+    switches = request.args.getlist('switch') or None
+    if switches and any(switch not in manager for switch in switches):
+        return error(404, 'Unknown switch in %s' % ', '.join(switches))
+    try:
+        start, end = get_forecast_range()
+    except ValueError as e:
+        return error(400, str(e))
+    limit = request.args.get('limit', '1000')
+    if not limit.isascii() or not limit.isdigit():
+        return error(400, 'Invalid limit %s, an integer of at least 0 is expected' % limit)
+    transitions = islice(manager.forecast(start, end, switches=switches), int(limit))
+    return jsonify([{'date': date.isoformat(), 'switch': switch, 'level': level}
+                    for date, switch, level in transitions])
+
+
+@api.route('/forecast/usage')
+def get_forecast_usage():
+    """ Returns the on time in seconds and the energy of the given switches, all by default. """
+    manager = current_app.switch_manager
+    switches = request.args.getlist('switch') or None
+    if switches and any(switch not in manager for switch in switches):
+        return error(404, 'Unknown switch in %s' % ', '.join(switches))
+    try:
+        start, end = get_forecast_range()
+    except ValueError as e:
+        return error(400, str(e))
+    usages = manager.forecast_usage(start, end, switches=switches)
+    return jsonify({switch: {'on_time': usage['on_time'].total_seconds(), 'energy': usage['energy']}
+                    for switch, usage in usages.items()})
+
+
+@api.route('/events')
+def get_events():
+    """ Streams the level, mode and active schedule changes of the switches and the new log records. """
+    keepalive = current_app.switch_config.get('events_keepalive', 15)
+    return Response(stream_events(current_app.event_bus, keepalive=keepalive), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
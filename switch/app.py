@@ -2,19 +2,23 @@
 # This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
 # more information about the licensing of this file.
 #
-import hashlib
 import json
 import os
+import time
 
-from flask import Flask, render_template, request, flash, redirect, url_for, Response
+from flask import Flask, render_template, request, flash, redirect, url_for, Response, g, abort, jsonify
 from flask_bower import Bower
 
 from switch import join_root
+from switch.api import api
+from switch.auth import BasicAuthenticator
+from switch.events import EventBus
+from switch.metrics import registry, request_seconds
+from switch.persistence import get_state_store
 from switch.switch_manager import SwitchManager
-from switch.time.schedule import Schedule
-from switch.time.time_interval import WeightedTimeInterval, Instant
+from switch.time.schedule import SlotSchedule
 from switch.utils import ensure_directory_exists, load_config_file, mode_to_html
-from switch.log import app_logger as logger, get_frontend_logger
+from switch.log import app_logger as logger, configure_app_logger, get_frontend_logger
 
 ensure_directory_exists(join_root('data'))
 
@@ -23,15 +27,58 @@ app.secret_key = os.environ.get('SECRET_KEY')
 app.config['BOWER_COMPONENTS_ROOT'] = '../bower_components'
 app.config['BOWER_QUERYSTRING_REVVING'] = False
 Bower(app)
+app.register_blueprint(api, url_prefix='/api/v1')
 app.switch_config = load_config_file(join_root('configuration' + os.extsep + 'yaml'))
-app.switch_manager = SwitchManager(app.switch_config['switches'])
-frontend_logger = get_frontend_logger()
+registry.enabled = app.switch_config.get('metrics', False)
+configure_app_logger(level=app.switch_config.get('log_level', 'DEBUG'),
+                     max_size=app.switch_config.get('log_max_size', 8 * 1024 * 1024),
+                     backups=app.switch_config.get('log_backups', 4))
+state_store = get_state_store(app.switch_config.get('state_store', 'json'), join_root('data'),
+                              save_delay=app.switch_config.get('save_delay', 0.5))
+app.event_bus = EventBus(max_queued=app.switch_config.get('events_queue_size', 100))
+app.switch_manager = SwitchManager(app.switch_config['switches'],
+                                   scheduler=app.switch_config.get('scheduler', 'thread'),
+                                   actuation_workers=app.switch_config.get('actuation_workers', 4),
+                                   actuation_timeout=app.switch_config.get('actuation_timeout', 10),
+                                   resync_interval=app.switch_config.get('resync_interval'),
+                                   state_store=state_store, event_bus=app.event_bus, start=False)
+# The switches are actuated to their stored levels by a thread, so that the web server does not wait for them.
+app.switch_manager.start(background=True)
+frontend_logger = get_frontend_logger(recent_records=app.switch_config.get('logs_recent_records', 200),
+                                      segment_size=app.switch_config.get('logs_segment_size', 1024 * 1024),
+                                      max_size=app.switch_config.get('logs_max_size', 64 * 1024 * 1024))
 frontend_handler = frontend_logger.handlers[0]
 frontend_handler.get_context_name = lambda x: app.switch_manager[x]['name'] if x in app.switch_manager else x.title()
+frontend_handler.on_record = lambda seq, date, context, message: app.event_bus.publish(
+    'log', {'id': seq, 'context': frontend_handler.get_context_name(context), 'message': message,
+            'date': date.isoformat()})
 
 
-def check_auth(user, password):
-    return user == app.switch_config['user'] and hashlib.sha256(password.encode()).hexdigest() == app.switch_config['password']
+def collect_manager_stats():
+    manager = app.switch_manager
+    stats = manager.actuation_stats
+    return [
+        ('switch_actuations_total', 'counter', 'Actuations of the switches, by outcome.',
+         [({'outcome': outcome}, stats[outcome]) for outcome in ('issued', 'skipped', 'failed')]),
+        ('switch_resyncs_total', 'counter', 'Actuations of all the switches to their current level.',
+         [({}, stats['resyncs'])]),
+        ('switch_store_operations_total', 'counter', 'Operations of the state store, by type.',
+         [({'type': name}, value) for name, value in sorted(manager.persistence_stats.items())]),
+        ('switch_event_stream_clients', 'gauge', 'Clients connected to the event stream.', [({}, len(app.event_bus))]),
+    ]
+
+
+registry.add_collector(collect_manager_stats)
+
+
+authenticator = BasicAuthenticator(app.switch_config['user'], app.switch_config['password'],
+                                   cache_size=app.switch_config.get('auth_cache_size', 64),
+                                   cache_ttl=app.switch_config.get('auth_cache_ttl', 300))
+public_endpoints = {'static', 'bower.serve', 'liveness', 'readiness'}
+
+
+def check_auth(user, password, header=None):
+    return authenticator.check(user, password, header)
 
 
 def authenticate():
@@ -41,10 +88,28 @@ def authenticate():
                     {'WWW-Authenticate': 'Basic realm="Login Required"'})
 
 
+@app.before_request
+def start_request_timer():
+    if registry.enabled:
+        g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        request_seconds.observe(time.perf_counter() - start, request.method, request.endpoint or 'unknown',
+                                response.status_code)
+    return response
+
+
 @app.before_request
 def ensure_auth():
+    header = request.headers.get('Authorization')
+    if request.endpoint in public_endpoints or authenticator.is_verified(header):
+        return
     auth = request.authorization
-    if not auth or not check_auth(auth.username, auth.password):
+    if not auth or not check_auth(auth.username, auth.password, header):
         return authenticate()
 
 
@@ -55,7 +120,28 @@ def inject_switch_manager():
 
 @app.route('/')
 def index():
-    return render_template('index.html', logs=frontend_handler.get_records())
+    before = request.args.get('before', type=int)
+    logs = frontend_handler.get_records(limit=app.switch_config.get('logs_per_page', 50), before=before)
+    return render_template('index.html', logs=logs, logs_before=before, logs_first=frontend_handler.first_record_id)
+
+
+@app.route('/health/live')
+def liveness():
+    return jsonify(status='alive', **app.switch_manager.startup_progress)
+
+
+@app.route('/health/ready')
+def readiness():
+    """ Answers 503 until the switches were actuated to their stored levels and the scheduler started. """
+    progress = app.switch_manager.startup_progress
+    return jsonify(status='ready' if progress['ready'] else 'starting', **progress), 200 if progress['ready'] else 503
+
+
+@app.route('/metrics')
+def metrics():
+    if not registry.enabled:
+        abort(404)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/configuration/<switch>', methods=['GET'])
@@ -82,10 +168,7 @@ def post_configure_switch(switch):
         flash('schedule_already_exists')
         return redirect(url_for('get_configure_switch', switch=switch))
 
-    intervals = []
-    for a, b, l in schedule_intervals:
-        intervals.append(WeightedTimeInterval(Instant(minute=15 * a), Instant(minute=15 * b), w=l))
-    app.switch_manager.add_schedule(switch, schedule_name, Schedule(intervals))
+    app.switch_manager.add_schedule(switch, schedule_name, SlotSchedule.from_interface_list(schedule_intervals))
     logger.info('Schedule %s was created', schedule_name, extra=dict(context=switch))
     flash('schedule_created')
     return redirect(url_for('index'))
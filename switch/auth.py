@@ -0,0 +1,88 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import hashlib
+import hmac
+import time
+from threading import Lock
+
+
+class CredentialsCache(object):
+    """
+        The values of the Authorization headers verified in the last ttl seconds, at most max_size of them, the ones
+        verified first being dropped first. Looking a header up is a mere dict lookup, so that a client sending the same
+        header on each request is not verified again.
+
+        >>> cache = CredentialsCache(max_size=1)
+        >>> cache.add('Basic YWRtaW46YQ==')
+        >>> 'Basic YWRtaW46YQ==' in cache, None in cache
+        (True, False)
+        >>> cache.add('Basic YWRtaW46Yg==')
+        >>> 'Basic YWRtaW46YQ==' in cache, 'Basic YWRtaW46Yg==' in cache
+        (False, True)
+        >>> cache = CredentialsCache(ttl=0)
+        >>> cache.add('Basic YWRtaW46YQ==')
+        >>> 'Basic YWRtaW46YQ==' in cache
+        False
+    """
+
+    def __init__(self, max_size=64, ttl=300):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = {}  # The expiry of each header, in the order in which they were verified
+        self._lock = Lock()
+
+    def __contains__(self, header):
+        expiry = self._entries.get(header)
+        return expiry is not None and expiry > time.monotonic()
+
+    def add(self, header):
+        with self._lock:
+            self._entries.pop(header, None)
+            self._entries[header] = time.monotonic() + self._ttl
+            while len(self._entries) > self._max_size:
+                del self._entries[next(iter(self._entries))]
+
+
+class BasicAuthenticator(object):
+    """
+        Verifies basic auth credentials against a user and the SHA256 hash of its password in constant time.
+        The Authorization header holding verified credentials is cached, so that it is only verified again once its
+        cache entry expired.
+
+        >>> authenticator = BasicAuthenticator('admin', hashlib.sha256(b'secret').hexdigest())
+        >>> authenticator.check('admin', 'secret'), authenticator.check('admin', 'wrong')
+        (True, False)
+        >>> authenticator.check('root', 'secret')
+        False
+        >>> authenticator.is_verified('Basic YWRtaW46c2VjcmV0')
+        False
+        >>> authenticator.check('admin', 'secret', header='Basic YWRtaW46c2VjcmV0')
+        True
+        >>> authenticator.is_verified('Basic YWRtaW46c2VjcmV0')
+        True
+    """
+
+    def __init__(self, user, password_hash, cache_size=64, cache_ttl=300):
+        self._user = user.encode()
+        self._password_hash = password_hash.lower().encode()
+        self._cache = CredentialsCache(max_size=cache_size, ttl=cache_ttl)
+
+    def is_verified(self, header):
+        """ Returns whether the given value of the Authorization header holds recently verified credentials. """
+        return header in self._cache
+
+    def check(self, user, password, header=None):
+        """ Verifies the given credentials, caching the Authorization header holding them if given and valid. """
+        password_hash = hashlib.sha256(password.encode()).hexdigest().encode()
+        # Both comparisons are always made, so that the time taken does not tell which one failed.
+        valid_user = hmac.compare_digest(user.encode(), self._user)
+        valid_password = hmac.compare_digest(password_hash, self._password_hash)
+        if valid_user and valid_password:
+            if header is not None:
+                self._cache.add(header)
+            return True
+        return False
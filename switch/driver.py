@@ -0,0 +1,99 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+from collections import deque
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+
+
+class DriverError(Exception):
+    pass
+
+
+class Driver(object):
+    """
+        The base class of the class-based drivers, an alternative to the on and off functions of a switch module.
+        A module of the switches package defining a Driver class gets one instance per controller, i.e. per value of
+        the controller attribute of its switches, which is given the definitions of the switches it controls.
+        The instance is opened once the switch manager is loaded and closed when it stops, and receives the levels of
+        all its switches changing at once, so that it can keep its connections open and group its commands.
+    """
+
+    def __init__(self, controller, switches):
+        self.controller = controller
+        self.switches = switches
+
+    @property
+    def name(self):
+        return '%s@%s' % (self.__class__.__module__.rsplit('.', 1)[-1], self.controller)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def set_levels(self, levels):
+        """ Sets the level of each switch of the given dict, raising an exception if the controller failed. """
+        raise NotImplementedError
+
+
+class ConnectionPool(object):
+    """
+        A pool of at most size connections to a controller, created by the connect function when none is idle.
+        A connection is closed instead of being returned to the pool if an exception is raised while it is used.
+
+        >>> class Connection(object):
+        ...     closed = False
+        ...     def close(self):
+        ...         self.closed = True
+        >>> pool = ConnectionPool(Connection, size=2)
+        >>> with pool.connection() as first:
+        ...     pass
+        >>> with pool.connection() as second:
+        ...     second is first
+        True
+        >>> with pool.connection() as failed:
+        ...     raise DriverError('No answer')
+        Traceback (most recent call last):
+        switch.driver.DriverError: No answer
+        >>> failed.closed, pool.connections_opened
+        (True, 1)
+        >>> with pool.connection() as third:
+        ...     third is first
+        False
+        >>> pool.close()
+        >>> third.closed, pool.connections_opened
+        (True, 2)
+    """
+
+    def __init__(self, connect, size=2):
+        self._connect = connect
+        self._idle = deque()
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(size)
+        self.connections_opened = 0
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = self._connect()
+                self.connections_opened += 1
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            with self._lock:
+                self._idle.append(connection)
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
@@ -0,0 +1,147 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import itertools
+import json
+from collections import deque
+from threading import Condition, Lock
+
+from switch.log import app_logger as logger
+
+
+class Subscription(object):
+    """
+        A bounded queue of the events published to a client.
+        A client letting more than max_queued events pile up is dropped: its queue is cleared and no more events are
+        delivered to it, so that a slow consumer never makes the publishers wait nor the memory grow.
+
+        >>> subscription = Subscription(max_queued=2)
+        >>> subscription.put('a'), subscription.put('b'), subscription.put('c')
+        (True, True, False)
+        >>> subscription.dropped, subscription.get(timeout=0)
+        (True, None)
+    """
+
+    def __init__(self, max_queued=100):
+        self._max_queued = max_queued
+        self._events = deque()
+        self._condition = Condition()
+        self.dropped = False
+        self.closed = False
+
+    def put(self, event):
+        """ Queues the given event and returns whether the subscription is still alive. """
+        with self._condition:
+            if self.dropped or self.closed:
+                return False
+            if len(self._events) >= self._max_queued:
+                self.dropped = True
+                self._events.clear()
+            else:
+                self._events.append(event)
+            self._condition.notify_all()
+            return not self.dropped
+
+    def get(self, timeout=None):
+        """ Returns the next event, or None if the subscription ended or no event was published within timeout. """
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self.dropped or self.closed, timeout)
+            return self._events.popleft() if self._events else None
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class EventBus(object):
+    """
+        Publishes the changes of the switches and the new log records to the subscribed clients.
+
+        >>> bus = EventBus()
+        >>> bus.publish('level', {'switch': 'heater', 'level': 1})  # Nobody is subscribed, the event is discarded
+        >>> subscription = bus.subscribe()
+        >>> bus.publish('mode', {'switch': 'heater', 'mode': 3})
+        >>> print(to_server_sent_event(subscription.get(timeout=0)), end='')
+        id: 1
+        event: mode
+        data: {"switch":"heater","mode":3}
+        <BLANKLINE>
+        >>> bus.unsubscribe(subscription)
+        >>> len(bus), subscription.get(timeout=0)
+        (0, None)
+    """
+
+    def __init__(self, max_queued=100):
+        self._max_queued = max_queued
+        self._subscriptions = set()
+        self._lock = Lock()
+        self._ids = itertools.count(1)
+        self.dropped = 0
+
+    def subscribe(self):
+        subscription = Subscription(max_queued=self._max_queued)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event_type, data):
+        """ Sends the given JSON-serializable data as an event of the given type to all subscribers, never blocking. """
+        with self._lock:
+            if not self._subscriptions:
+                return
+            event = (next(self._ids), event_type, data)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if not subscription.put(event):
+                self.unsubscribe(subscription)
+                if subscription.dropped:
+                    self.dropped += 1
+                    logger.warning('An event stream client was dropped for being too slow',
+                                   extra=dict(context='General'))
+
+    def close(self):
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, set()
+        for subscription in subscriptions:
+            subscription.close()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+
+def to_server_sent_event(event):
+    """ Returns the given (id, type, data) event formatted as a server-sent event. """
+    event_id, event_type, data = event
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (event_id, event_type, json.dumps(data, separators=(',', ':')))
+
+
+def stream_events(bus, keepalive=15):
+    """
+        Yields the events published to the bus as server-sent events until the client is dropped or disconnects.
+        A comment is sent when no event was published for keepalive seconds, so that proxies keep the connection open.
+    """
+    subscription = bus.subscribe()
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            event = subscription.get(timeout=keepalive)
+            if event is not None:
+                yield to_server_sent_event(event)
+            elif subscription.dropped:
+                yield 'event: dropped\ndata: {}\n\n'
+                return
+            elif subscription.closed:
+                return
+            else:
+                yield ': keepalive\n\n'
+    finally:
+        bus.unsubscribe(subscription)
@@ -4,68 +4,435 @@
 #
 
 
+import atexit
 import json
 import logging
 import os
+import queue
+import struct
+from array import array
+from bisect import bisect_right
+from collections import deque
 from datetime import datetime
-from pathlib import Path
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from threading import Lock
 
 from switch import join_root
-from switch.utils import timesince, DateTimeEncoder, DateTimeDecoder
+from switch.utils import timesince, ensure_directory_exists, DateTimeEncoder, DateTimeDecoder
 
 
-def get_app_logger():
+class BackgroundHandler(QueueHandler):
+    """
+        Hands the records over to the given handler, which is run in a thread of its own so that logging never waits
+        for the disk. Messages are formatted before being queued, so that records do not refer to objects changing
+        meanwhile.
+    """
+
+    def __init__(self, handler):
+        super().__init__(queue.SimpleQueue())
+        self.handler = handler
+        self._listener = QueueListener(self.queue, handler, respect_handler_level=True)
+        self._listener.start()
+        atexit.register(self.stop)
+
+    def prepare(self, record):
+        # Being the only handler of its logger, it merges the arguments in place rather than formatting a copy.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.handler.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def stop(self):
+        """ Waits for the queued records to be handled and stops the thread of the handler. """
+        if self._listener._thread is not None:
+            self._listener.stop()
+
+
+def get_app_logger(max_size=8 * 1024 * 1024, backups=4):
     logger = logging.getLogger('switch.py')
-    file_handler = logging.FileHandler(filename=join_root('app.log'))
+    file_handler = RotatingFileHandler(filename=join_root('app.log'), maxBytes=max_size, backupCount=backups,
+                                       delay=True)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(
         logging.Formatter('%(asctime)s - %(module)s - [%(context)s] - %(levelname)s - %(message)s'))
-    logger.addHandler(file_handler)
+    logger.addHandler(BackgroundHandler(file_handler))
     logger.setLevel(logging.DEBUG)
     return logger
 
 
-def get_frontend_logger():
+def configure_app_logger(level='DEBUG', max_size=8 * 1024 * 1024, backups=4):
+    """ Applies the settings of the configuration file to the app logger, which is created when this is imported. """
+    app_logger.setLevel(level)
+    for handler in app_logger.handlers:
+        if isinstance(handler, BackgroundHandler):
+            handler.handler.maxBytes = max_size
+            handler.handler.backupCount = backups
+
+
+def get_frontend_logger(**store_options):
+    """
+        Returns the logger of the home page. Its FrontendHandler is not run in the background, as its records are
+        read right after being written, its store only appending them to a ring buffer and to a file.
+    """
     logger = logging.getLogger('switch.py-frontend')
-    handler = FrontendHandler(level=logging.INFO)
-    logging.Formatter('')
+    handler = FrontendHandler(level=logging.INFO, **store_options)
     logger.addHandler(handler)
     logger.setLevel(logging.INFO)
     return logger
 
 
+class JsonLinesFormat(object):
+    """ The format of the log segments of previous versions, in which each record is a JSON list on its own line. """
+
+    extension = 'log'
+
+    @staticmethod
+    def encode(record):
+        return (json.dumps(record, cls=DateTimeEncoder) + '\n').encode()
+
+    @staticmethod
+    def index(data):
+        """ Returns the offsets of the complete records of the given data and the end of the last one. """
+        offsets = array('Q')
+        offset = 0
+        end = data.find(b'\n')
+        while end >= 0:
+            offsets.append(offset)
+            offset = end + 1
+            end = data.find(b'\n', offset)
+        return offsets, offset
+
+    @staticmethod
+    def decode(data):
+        return [tuple(json.loads(line, cls=DateTimeDecoder)) for line in data.splitlines()]
+
+    @staticmethod
+    def read_tail(f, count, block_size):
+        """ Decodes the count last records of the given file by reading it backwards from its end. """
+        end = f.seek(0, os.SEEK_END)
+        data = b''
+        # When not at the start of the file, the first line read can be incomplete.
+        while end > 0 and data.count(b'\n') <= count:
+            start = max(0, end - block_size)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+        lines = data.splitlines()[1:] if end > 0 else data.splitlines()
+        return [tuple(json.loads(line, cls=DateTimeDecoder)) for line in lines[max(0, len(lines) - count):]]
+
+
+class BinaryFormat(object):
+    """
+        A compact format of log segments, in which each record is made of a header holding its epoch timestamp, the
+        id of its context and the length of its message, followed by the message and by the length of the record,
+        allowing to read records backwards. Contexts are interned in a file mapping each id to a name on its line.
+    """
+
+    extension = 'bin'
+    header = struct.Struct('<dHI')
+    trailer = struct.Struct('<I')
+
+    def __init__(self, contexts_path):
+        self._contexts_path = contexts_path
+        self._contexts = []
+        if os.path.exists(contexts_path):
+            with open(contexts_path, 'r') as f:
+                self._contexts = f.read().splitlines()
+        self._context_ids = {context: idx for idx, context in enumerate(self._contexts)}
+
+    def encode(self, record):
+        date, context, message = record
+        if context not in self._context_ids:
+            with open(self._contexts_path, 'a') as f:
+                f.write(context + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._context_ids[context] = len(self._contexts)
+            self._contexts.append(context)
+        message = message.encode()
+        size = self.header.size + len(message) + self.trailer.size
+        return self.header.pack(date.timestamp(), self._context_ids[context], len(message)) + message + \
+            self.trailer.pack(size)
+
+    def index(self, data):
+        """ Returns the offsets of the complete records of the given data and the end of the last one. """
+        offsets = array('Q')
+        offset = 0
+        while offset + self.header.size <= len(data):
+            end = offset + self.header.size + self.header.unpack_from(data, offset)[2] + self.trailer.size
+            if end > len(data):
+                break
+            offsets.append(offset)
+            offset = end
+        return offsets, offset
+
+    def decode(self, data):
+        records = []
+        view = memoryview(data)
+        offset = 0
+        while offset < len(view):
+            timestamp, context_id, length = self.header.unpack_from(view, offset)
+            offset += self.header.size
+            records.append((datetime.fromtimestamp(timestamp), self._contexts[context_id],
+                            str(view[offset:offset + length], 'utf-8')))
+            offset += length + self.trailer.size
+        return records
+
+    def read_tail(self, f, count, block_size):
+        """ Decodes the count last records of the given file by reading it backwards from its end. """
+        end = f.seek(0, os.SEEK_END)
+        data = b''
+        start = position = end  # data holds the bytes from start to end, records are parsed back to position
+        records = 0
+        while position > 0 and records < count:
+            if position - self.trailer.size < start:
+                # A record longer than a block can leave its trailer before the block preceding the data.
+                start = max(0, min(start - block_size, position - self.trailer.size))
+                f.seek(start)
+                data = f.read(end - start)
+            position -= self.trailer.unpack_from(data, position - self.trailer.size - start)[0]
+            records += 1
+        if position < start:
+            f.seek(position)
+            data = f.read(end - position)
+            start = position
+        return self.decode(data[position - start:])
+
+
+class FrontendLogStore(object):
+    """
+        Keeps the frontend log records in segments on disk, named after the sequence number of their first record,
+        and the most recent records in a bounded ring buffer.
+        Segments are written in the BinaryFormat, while segments in the JsonLinesFormat of previous versions can still
+        be read. A log file of a previous version found at legacy_path becomes the first segment, compacted to its most
+        recent records if it exceeds max_size.
+        At startup, only the most recent records are decoded, by reading the segments backwards from their end.
+        The byte offset of each record in a segment is indexed when a page of its records is first requested, so
+        that the page can be read without decoding the others.
+        A new segment is started when the current one exceeds segment_size bytes, and the oldest segments are
+        removed when all of them exceed max_size bytes.
+
+        >>> import tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> store = FrontendLogStore(directory, recent_records=2, segment_size=100, max_size=1000)
+        >>> for minute in range(20):
+        ...     _ = store.append((datetime(2017, 1, 2, 8, minute), 'heater', 'Level %d' % minute))
+        >>> [(seq, message) for seq, (_, _, message) in store.get(2)]
+        [(18, 'Level 18'), (19, 'Level 19')]
+        >>> [(seq, message) for seq, (_, _, message) in store.get(2, before=10)]
+        [(8, 'Level 8'), (9, 'Level 9')]
+        >>> store.close()
+        >>> store = FrontendLogStore(directory, recent_records=2, segment_size=100, max_size=300)
+        >>> store.first_seq, store.get(50)[0][0], store.get(50)[-1][1][2]
+        (12, 12, 'Level 19')
+        >>> store.close()
+        >>> directory = tempfile.mkdtemp()
+        >>> store = FrontendLogStore(directory, recent_records=3)
+        >>> for message in ('Before', 'x' * 3 * FrontendLogStore.block_size, 'After'):
+        ...     _ = store.append((datetime(2017, 1, 2, 8, 0), 'heater', message))
+        >>> store.close()
+        >>> store = FrontendLogStore(directory, recent_records=3)
+        >>> [(seq, len(message)) for seq, (_, _, message) in store.get(3)]
+        [(0, 6), (1, 196608), (2, 5)]
+        >>> store.close()
+    """
+
+    block_size = 64 * 1024
+
+    def __init__(self, directory, recent_records=200, segment_size=1024 * 1024, max_size=64 * 1024 * 1024,
+                 legacy_path=None):
+        self._directory = directory
+        self._segment_size = segment_size
+        self._max_size = max_size
+        self._lock = Lock()
+        self._segments = []  # The list of [first sequence number, path, format, offsets or None] of the segments
+        self._recent = deque(maxlen=recent_records)  # (sequence number, record) tuples
+
+        ensure_directory_exists(directory)
+        self._format = BinaryFormat(os.path.join(directory, 'contexts'))
+        formats = {f.extension: f for f in (JsonLinesFormat(), self._format)}
+        if legacy_path and os.path.exists(legacy_path) and not os.listdir(directory):
+            os.replace(legacy_path, os.path.join(directory, '%010d%s%s' % (0, os.extsep, JsonLinesFormat.extension)))
+        for name in sorted(os.listdir(directory)):
+            first_seq, _, extension = name.partition(os.extsep)
+            if extension in formats:
+                self._segments.append([int(first_seq), os.path.join(directory, name), formats[extension], None])
+        if not self._segments:
+            self._segments.append([0, self._get_segment_path(0), self._format, array('Q')])
+        elif self._segments[-1][2] is not self._format and os.path.getsize(self._segments[-1][1]) > self._max_size:
+            # Otherwise the whole log of a previous version would be removed at once when exceeding max_size.
+            self._compact(self._segments.pop())
+        first_seq, path, segment_format, _ = self._segments[-1]
+        self._segment_file = open(path, 'ab')
+        self._next_seq = first_seq + len(self._get_offsets(self._segments[-1], truncate=True))
+
+        records = self._read_tail(self._recent.maxlen)
+        self._recent.extend(zip(range(self._next_seq - len(records), self._next_seq), records))
+        if self._segment_file.tell() >= self._segment_size or segment_format is not self._format:
+            self._rotate()
+
+    def _get_segment_path(self, first_seq):
+        return os.path.join(self._directory, '%010d%s%s' % (first_seq, os.extsep, self._format.extension))
+
+    def _get_offsets(self, segment, truncate=False):
+        """ Returns the offsets of the records of the segment, truncating an incomplete last one if asked to. """
+        if segment[3] is None:
+            with open(segment[1], 'rb') as f:
+                data = f.read()
+            segment[3], end = segment[2].index(data)
+            if truncate and end < len(data):
+                self._segment_file.truncate(end)
+                self._segment_file.seek(end)
+        return segment[3]
+
+    def _compact(self, segment):
+        """
+            Replaces the given segment of a previous format by segments of at most segment_size bytes in the current
+            format, holding its most recent records which fit in max_size besides the segment being written.
+        """
+        first_seq, path, segment_format, _ = segment
+        with open(path, 'rb') as f:
+            data = f.read()
+        offsets, end = segment_format.index(data)
+        budget = self._max_size - self._segment_size if self._max_size > self._segment_size else self._max_size // 2
+        encoded = []
+        size = 0
+        for idx in range(len(offsets) - 1, -1, -1):
+            record_data = data[offsets[idx]:offsets[idx + 1] if idx + 1 < len(offsets) else end]
+            record = self._format.encode(segment_format.decode(record_data)[0])
+            if size + len(record) > budget:
+                break
+            encoded.append(record)
+            size += len(record)
+        seq = first_seq + len(offsets) - len(encoded)
+        segment_seq, segment_records, segment_size = seq, [], 0
+        for record in reversed(encoded):
+            segment_records.append(record)
+            segment_size += len(record)
+            seq += 1
+            if segment_size >= self._segment_size or seq == first_seq + len(offsets):
+                compacted_path = self._get_segment_path(segment_seq)
+                with open(compacted_path, 'wb') as f:
+                    f.write(b''.join(segment_records))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._segments.append([segment_seq, compacted_path, self._format, None])
+                segment_seq, segment_records, segment_size = seq, [], 0
+        if not encoded:
+            self._segments.append([seq, self._get_segment_path(seq), self._format, array('Q')])
+        os.remove(path)
+
+    def _read_tail(self, count):
+        """ Decodes the count last records by reading the segments backwards from their end. """
+        records = []
+        for _, path, segment_format, _ in reversed(self._segments):
+            if len(records) >= count:
+                break
+            with open(path, 'rb') as f:
+                records[:0] = segment_format.read_tail(f, count - len(records), self.block_size)
+        return records
+
+    def _rotate(self):
+        self._segment_file.close()
+        path = self._get_segment_path(self._next_seq)
+        self._segments.append([self._next_seq, path, self._format, array('Q')])
+        self._segment_file = open(path, 'ab')
+
+        sizes = [os.path.getsize(p) for _, p, _, _ in self._segments]
+        while len(self._segments) > 1 and sum(sizes) > self._max_size:
+            _, path, _, _ = self._segments.pop(0)
+            sizes.pop(0)
+            os.remove(path)
+
+    @property
+    def first_seq(self):
+        """ The sequence number of the oldest record still stored, the older ones having been removed. """
+        with self._lock:
+            return self._segments[0][0]
+
+    def append(self, record):
+        """ Appends the given (datetime, context, message) record and returns its sequence number. """
+        with self._lock:
+            if self._segment_file.tell() >= self._segment_size:
+                self._rotate()
+            data = self._format.encode(record)
+            if self._segments[-1][3] is not None:
+                self._segments[-1][3].append(self._segment_file.tell())
+            self._segment_file.write(data)
+            self._segment_file.flush()
+            seq = self._next_seq
+            self._next_seq += 1
+            self._recent.append((seq, record))
+        return seq
+
+    def get(self, limit, before=None):
+        """ Returns the list of the (sequence number, record) tuples of at most limit records preceding before. """
+        with self._lock:
+            before = self._next_seq if before is None else max(0, min(before, self._next_seq))
+            start = max(self._segments[0][0], before - limit)
+            if start >= before:
+                return []
+            if self._recent and start >= self._recent[0][0]:
+                first = self._recent[0][0]
+                return list(islice(self._recent, start - first, before - first))
+            return list(zip(range(start, before), self._read(start, before)))
+
+    def _read(self, start, stop):
+        """ Reads the records having sequence numbers in [start, stop) from the segments. """
+        records = []
+        idx = max(bisect_right([segment[0] for segment in self._segments], start) - 1, 0)
+        for segment in self._segments[idx:]:
+            first_seq, path, segment_format, _ = segment
+            if first_seq >= stop:
+                break
+            offsets = self._get_offsets(segment)
+            first, last = max(start - first_seq, 0), min(stop - first_seq, len(offsets))
+            if first >= last:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(offsets[first])
+                data = f.read(offsets[last] - offsets[first]) if last < len(offsets) else f.read()
+            records.extend(segment_format.decode(data)[:last - first])
+        return records
+
+    def close(self):
+        with self._lock:
+            self._segment_file.close()
+
+
 class FrontendHandler(logging.Handler):
-    def __init__(self, level=logging.NOTSET):
-        frontend_logs_path = join_root('data', 'frontend_logs.data')
-        self._records = []
-        if os.path.exists(frontend_logs_path):
-            with open(frontend_logs_path, 'r') as f:
-                for line in f.readlines():
-                    self._records.append(json.loads(line, cls=DateTimeDecoder))
-        else:
-            Path(frontend_logs_path).touch()
-        self._records_file = open(frontend_logs_path, 'a+')
-        self._records_file_lock = Lock()
+    def __init__(self, level=logging.NOTSET, directory=None, **store_options):
+        self._store = FrontendLogStore(directory or join_root('data', 'frontend_logs'),
+                                       legacy_path=join_root('data', 'frontend_logs.data'), **store_options)
         self.get_context_name = None
+        self.on_record = None
         super().__init__(level)
 
     def emit(self, record):
-        record = (datetime.fromtimestamp(record.created), record.context, record.getMessage())
-        self._records.append(record)
-        with self._records_file_lock:
-            json.dump(record, self._records_file, cls=DateTimeEncoder)
-            self._records_file.write('\n')
-            self._records_file.flush()
-
-    def get_records(self):
+        date, message = datetime.fromtimestamp(record.created), record.getMessage()
+        seq = self._store.append((date, record.context, message))
+        if self.on_record is not None:
+            self.on_record(seq, date, record.context, message)
+
+    @property
+    def first_record_id(self):
+        """ The id of the oldest record which can be returned by get_records. """
+        return self._store.first_seq
+
+    def get_records(self, limit=50, before=None):
+        """
+            Returns the list of the (id, context name, message, time since, date) tuples of at most limit records
+            preceding the record with the given id, from the most recent to the oldest.
+        """
         logs_records = []
-        for date, context, message in self._records:
-            logs_records.append((self.get_context_name(context), message, timesince(date), date.strftime('%c')))
-        logs_records.reverse()
+        for seq, (date, context, message) in reversed(self._store.get(limit, before)):
+            logs_records.append((seq, self.get_context_name(context), message, timesince(date), date.strftime('%c')))
         return logs_records
 
     def __del__(self):
-        self._records_file.close()
+        self._store.close()
 
 app_logger = get_app_logger()
@@ -0,0 +1,149 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_null_timer = nullcontext()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for name, value in labels)
+    return '{%s}' % ','.join(escaped)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """
+        A histogram of durations in seconds for each combination of values of its labels, exposed in the Prometheus
+        text format. Observations are ignored while the registry is disabled, in which case time returns a shared
+        context manager doing nothing.
+    """
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._buckets = tuple(buckets)
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value, *labels):
+        """ Counts the given value for the given values of the labels, in the order of the label names. """
+        if not self._registry.enabled:
+            return
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # The count of each bucket and of the values above the last one, followed by the sum of the values.
+                entry = self._values[labels] = [0] * (len(self._buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def time(self, *labels):
+        """ Returns a context manager observing the time spent in its block. """
+        return self._time(labels) if self._registry.enabled else _null_timer
+
+    @contextmanager
+    def _time(self, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def collect(self):
+        yield '# HELP %s %s' % (self.name, self.documentation)
+        yield '# TYPE %s histogram' % self.name
+        with self._lock:
+            values = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        for labels, entry in values:
+            labels = list(zip(self._labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self._buckets + ('+Inf',), entry):
+                cumulative += count
+                yield '%s_bucket%s %d' % (self.name, _format_labels(labels + [('le', bound)]), cumulative)
+            yield '%s_sum%s %r' % (self.name, _format_labels(labels), entry[-1])
+            yield '%s_count%s %d' % (self.name, _format_labels(labels), cumulative)
+
+
+class MetricsRegistry(object):
+    """
+        The metrics of the application, disabled by default. Besides its histograms, it collects the values returned
+        by the functions given to add_collector, as lists of (name, type, documentation, samples) where samples is a
+        list of (labels dict, value), so that existing counters are only read when the metrics are rendered.
+
+        >>> metrics = MetricsRegistry()
+        >>> latency = metrics.histogram('latency_seconds', 'Latency.', ('path',), buckets=(0.1, 1))
+        >>> latency.observe(0.5, '/a')
+        >>> metrics.enabled = True
+        >>> latency.observe(0.05, '/a')
+        >>> latency.observe(2.0, '/a')
+        >>> metrics.add_collector(lambda: [('switches', 'gauge', 'Switches.', [({}, 3)])])
+        >>> print(metrics.render(), end='')
+        # HELP latency_seconds Latency.
+        # TYPE latency_seconds histogram
+        latency_seconds_bucket{path="/a",le="0.1"} 1
+        latency_seconds_bucket{path="/a",le="1"} 1
+        latency_seconds_bucket{path="/a",le="+Inf"} 2
+        latency_seconds_sum{path="/a"} 2.05
+        latency_seconds_count{path="/a"} 2
+        # HELP switches Switches.
+        # TYPE switches gauge
+        switches 3
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._histograms = []
+        self._collectors = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(self, name, documentation, labelnames, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def render(self):
+        """ Returns all the metrics in the Prometheus text exposition format. """
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.collect())
+        for collect in self._collectors:
+            for name, metric_type, documentation, samples in collect():
+                lines.append('# HELP %s %s' % (name, documentation))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                for labels, value in samples:
+                    lines.append('%s%s %s' % (name, _format_labels(sorted(labels.items())), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+actuation_seconds = registry.histogram('switch_actuation_seconds', 'Duration of the actuations of the switches.',
+                                       ('module', 'function'))
+event_delay_seconds = registry.histogram('switch_event_delay_seconds',
+                                         'Delay between the scheduled and the actual handling of the events.')
+save_seconds = registry.histogram('switch_save_seconds', 'Duration of the saves of switches to the state store, '
+                                  'which only queue the writes of the JSON store.')
+write_seconds = registry.histogram('switch_store_write_seconds',
+                                   'Duration of the writes of the JSON store, synced to the disk and renamed.')
+next_action_seconds = registry.histogram('switch_next_action_seconds',
+                                         'Duration of the computations of the next action of a switch.')
+request_seconds = registry.histogram('switch_http_request_seconds', 'Duration of the HTTP requests.',
+                                     ('method', 'endpoint', 'status'))
@@ -0,0 +1,281 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Condition, Lock
+
+from switch.log import app_logger as logger
+from switch.metrics import write_seconds
+
+
+def write_atomically(path, data):
+    """ Writes the given string to the file at path through a temporary file renamed once synced to the disk. """
+    temporary_path = path + os.extsep + 'tmp'
+    with open(temporary_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+class CoalescingWriter(object):
+    """
+        Writes files atomically in a background thread.
+        A file is written delay seconds after a write was requested, the writes requested meanwhile for the same file
+        being coalesced into the latest one.
+
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'heater.json')
+        >>> writer = CoalescingWriter(delay=60)
+        >>> writer.write(path, '{"level": 1}')
+        >>> writer.write(path, '{"level": 2}')
+        >>> os.path.exists(path)
+        False
+        >>> writer.flush()
+        >>> open(path).read(), writer.stats
+        ('{"level": 2}', {'performed': 1, 'coalesced': 1})
+        >>> writer.close()
+    """
+
+    def __init__(self, delay=0.5):
+        self._delay = delay
+        self._pending = {}
+        self._deadlines = {}
+        self._writing = 0
+        self._running = True
+        self._condition = Condition()
+        self.writes_performed = 0
+        self.writes_coalesced = 0
+        self._thread = Thread(target=self._run, name='switch.py-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, path, data):
+        """ Requests the given string to be written to the file at path. """
+        with self._condition:
+            if path in self._pending:
+                self.writes_coalesced += 1
+            else:
+                self._deadlines[path] = time.monotonic() + self._delay
+            self._pending[path] = data
+            self._condition.notify_all()
+
+    def flush(self):
+        """ Writes all pending files and waits for their completion. """
+        with self._condition:
+            for path in self._deadlines:
+                self._deadlines[path] = 0
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: not self._pending and not self._writing or not self._thread.is_alive())
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+    @property
+    def stats(self):
+        return {'performed': self.writes_performed, 'coalesced': self.writes_coalesced}
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._due_paths():
+                    timeout = min(self._deadlines.values()) - time.monotonic() if self._deadlines else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+                writes = [(path, self._pending.pop(path)) for path in self._due_paths()]
+                for path, _ in writes:
+                    del self._deadlines[path]
+                self._writing = len(writes)
+            for path, data in writes:
+                try:
+                    with write_seconds.time():
+                        write_atomically(path, data)
+                    self.writes_performed += 1
+                except OSError:
+                    logger.exception('Unable to write %s', path, extra=dict(context='General'))
+                with self._condition:
+                    self._writing -= 1
+                    self._condition.notify_all()
+
+    def _due_paths(self):
+        now = time.monotonic()
+        return [path for path, deadline in self._deadlines.items() if deadline <= now]
+
+
+class JsonStateStore(object):
+    """ A state store keeping the state and the schedules of each switch in its own JSON file. """
+
+    def __init__(self, directory, save_delay=0.5):
+        self._directory = directory
+        self._writer = CoalescingWriter(delay=save_delay)
+
+    def load(self, switch_ids):
+        """
+            Returns a dict associating the given switches having stored data with their state and schedules.
+            The files are read by a few threads, so that slow storage is not waited for one file at a time.
+        """
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix='switch.py-loader') as executor:
+            loaded = list(executor.map(self._load_switch_data, switch_ids))
+        return {switch_id: switch_data for switch_id, switch_data in zip(switch_ids, loaded) if switch_data is not None}
+
+    def _load_switch_data(self, switch_id):
+        switch_data_path = self.get_switch_data_path(switch_id)
+        if not os.path.exists(switch_data_path):
+            return None
+        with open(switch_data_path, 'r') as f:
+            return json.load(f)
+
+    def save(self, switches_data):
+        """ Stores the given dict associating switches with their state and schedules. """
+        for switch_id, switch_data in switches_data.items():
+            self._writer.write(self.get_switch_data_path(switch_id), json.dumps(switch_data))
+
+    def load_templates(self):
+        """ Returns the dict associating the names of the schedule templates with their schedules. """
+        templates_path = self.get_templates_path()
+        if not os.path.exists(templates_path):
+            return {}
+        with open(templates_path, 'r') as f:
+            return json.load(f)
+
+    def save_templates(self, templates_data):
+        """ Stores the given dict associating the names of all schedule templates with their schedules. """
+        self._writer.write(self.get_templates_path(), json.dumps(templates_data))
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+    @property
+    def stats(self):
+        return self._writer.stats
+
+    def get_switch_data_path(self, switch_id):
+        return os.path.join(self._directory, switch_id + os.extsep + 'json')
+
+    def get_templates_path(self):
+        return os.path.join(self._directory, 'templates' + os.extsep + 'json')
+
+
+class SQLiteStateStore(object):
+    """
+        A state store keeping the states and the schedules of all switches in a single SQLite database.
+        Each call to save is committed as a single transaction.
+        Switches missing from the database are migrated from the JSON files of json_directory when loaded.
+
+        >>> store = SQLiteStateStore(':memory:')
+        >>> store.save({'heater': {'level': 1, 'mode': 0, 'schedules': {'Office': {'template': 'Weekdays'}}}})
+        >>> store.load(['heater', 'pump'])
+        {'heater': {'level': 1, 'mode': 0, 'schedules': {'Office': {'template': 'Weekdays'}}}}
+        >>> store.save({'heater': {'level': 0, 'mode': 3, 'schedules': {}}})
+        >>> store.load(['heater']), store.stats
+        ({'heater': {'level': 0, 'mode': 3, 'schedules': {}}}, {'transactions': 2})
+        >>> store.close()
+    """
+
+    def __init__(self, path, json_directory=None):
+        self._json_store = JsonStateStore(json_directory) if json_directory else None
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self.transactions = 0
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS switches ('
+                                     'id TEXT PRIMARY KEY, state TEXT NOT NULL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS schedules ('
+                                     'switch TEXT NOT NULL, '
+                                     'name TEXT NOT NULL, schedule TEXT NOT NULL, PRIMARY KEY (switch, name))')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS templates ('
+                                     'name TEXT PRIMARY KEY, schedule TEXT NOT NULL)')
+
+    def load(self, switch_ids):
+        """ Returns a dict associating the given switches having stored data with their state and schedules. """
+        with self._lock:
+            rows = self._connection.execute('SELECT switches.id, switches.state, schedules.name, schedules.schedule '
+                                            'FROM switches LEFT JOIN schedules ON schedules.switch = switches.id')
+            switches_data = {}
+            for switch_id, state, schedule_name, schedule in rows:
+                if switch_id not in switches_data:
+                    switches_data[switch_id] = dict(json.loads(state), schedules={})
+                if schedule_name is not None:
+                    switches_data[switch_id]['schedules'][schedule_name] = json.loads(schedule)
+        switches_data = {switch_id: switches_data[switch_id] for switch_id in switch_ids if switch_id in switches_data}
+
+        if self._json_store:
+            migrated_data = self._json_store.load([s for s in switch_ids if s not in switches_data])
+            if migrated_data:
+                self.save(migrated_data)
+                switches_data.update(migrated_data)
+                logger.info('Migrated switches %s from their JSON files', list(migrated_data),
+                            extra=dict(context='General'))
+        return switches_data
+
+    def save(self, switches_data):
+        """ Stores the given dict associating switches with their state and schedules in a single transaction. """
+        with self._lock, self._connection:
+            for switch_id, switch_data in switches_data.items():
+                state = dict(switch_data)
+                schedules = state.pop('schedules')
+                self._connection.execute('INSERT OR REPLACE INTO switches (id, state) VALUES (?, ?)',
+                                         (switch_id, json.dumps(state)))
+                self._connection.execute('DELETE FROM schedules WHERE switch = ?', (switch_id,))
+                self._connection.executemany('INSERT INTO schedules (switch, name, schedule) VALUES (?, ?, ?)',
+                                             [(switch_id, name, json.dumps(schedule))
+                                              for name, schedule in schedules.items()])
+            self.transactions += 1
+
+    def load_templates(self):
+        """ Returns the dict associating the names of the schedule templates with their schedules. """
+        with self._lock:
+            rows = self._connection.execute('SELECT name, schedule FROM templates').fetchall()
+        templates_data = {name: json.loads(schedule) for name, schedule in rows}
+        if not templates_data and self._json_store:
+            templates_data = self._json_store.load_templates()
+            if templates_data:
+                self.save_templates(templates_data)
+        return templates_data
+
+    def save_templates(self, templates_data):
+        """ Replaces all schedule templates by the given ones in a single transaction. """
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM templates')
+            self._connection.executemany('INSERT INTO templates (name, schedule) VALUES (?, ?)',
+                                         [(name, json.dumps(schedule)) for name, schedule in templates_data.items()])
+            self.transactions += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @property
+    def stats(self):
+        return {'transactions': self.transactions}
+
+
+state_stores = {
+    'json': lambda directory, save_delay=0.5: JsonStateStore(directory, save_delay=save_delay),
+    'sqlite': lambda directory, save_delay=0.5: SQLiteStateStore(os.path.join(directory, 'switches.sqlite'),
+                                                                 json_directory=directory),
+}
+
+
+def get_state_store(name, directory, save_delay=0.5):
+    """ Returns a new state store of the given backend, either json or sqlite, keeping its data in directory. """
+    if name not in state_stores:
+        raise ValueError('Unknown state store backend %s, expected one of %s' % (name, ', '.join(state_stores)))
+    return state_stores[name](directory, save_delay=save_delay)
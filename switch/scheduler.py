@@ -0,0 +1,254 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import asyncio
+import heapq
+import itertools
+import math
+import sched
+import time
+from threading import Event, Thread, Lock
+
+from switch.log import app_logger as logger
+
+
+class ThreadedScheduler(object):
+    """
+        A scheduler running the events of a sched.scheduler in a dedicated thread.
+        The thread sleeps until the earliest event, and is woken up whenever an earlier event is scheduled or the
+        earliest one is cancelled, so that events fire at their exact timestamp.
+
+        >>> scheduler = ThreadedScheduler()
+        >>> scheduler.start()
+        >>> fired = Event()
+        >>> _ = scheduler.enterabs(time.time() + 30, print, ('late',))
+        >>> _ = scheduler.enterabs(time.time() + 0.05, fired.set)
+        >>> fired.wait(5)
+        True
+        >>> scheduler.stop()
+    """
+
+    max_delay = 60  # The thread wakes up at least every minute to follow wall-clock adjustments.
+
+    def __init__(self, timefunc=time.time):
+        self._running = False
+        self._timefunc = timefunc
+        self._wakeup = Event()
+        self._wake_time = math.inf  # The time until which the thread sleeps, infinite while it is awake
+        self._sched = sched.scheduler(timefunc=timefunc, delayfunc=self._wait)
+        self._thread = Thread(target=self._run, name='switch.py-scheduler', daemon=True)
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        for event in self._sched.queue:
+            self.cancel(event)
+        self._wakeup.set()
+
+    def enterabs(self, timestamp, action, argument=()):
+        """ Schedules the call of action with the given arguments at the given timestamp and returns the event. """
+        event = self._sched.enterabs(timestamp, 1, action, argument=argument)
+        if timestamp < self._wake_time:
+            self._wakeup.set()
+        return event
+
+    def cancel(self, event):
+        try:
+            self._sched.cancel(event)
+        except ValueError:
+            return  # The event is being run
+        if event.time <= self._wake_time:
+            self._wakeup.set()
+
+    def _wait(self, delay):
+        if delay <= 0:
+            return
+        delay = min(delay, self.max_delay)
+        self._wake_time = self._timefunc() + delay
+        self._wakeup.wait(delay)
+        self._wake_time = math.inf
+        self._wakeup.clear()
+
+    def _run(self):
+        while self._running:
+            self._sched.run()
+            if self._running:
+                self._wait(self.max_delay)
+
+
+class SimulatedScheduler(object):
+    """
+        A scheduler running its events in the virtual time of a SimulatedClock, without any thread.
+        Nothing runs until run_until is called, which moves the clock from event to event as fast as they are handled.
+
+        >>> from datetime import datetime
+        >>> from switch.time.clock import SimulatedClock
+        >>> clock = SimulatedClock(datetime(2017, 1, 2, 8, 0))
+        >>> scheduler = SimulatedScheduler(clock)
+        >>> def report(name):
+        ...     print(name, clock.now().time())
+        ...     if name == 'first':
+        ...         _ = scheduler.enterabs(clock.time() + 30, report, ('rescheduled',))
+        >>> _ = scheduler.enterabs(clock.time() + 3600, report, ('second',))
+        >>> _ = scheduler.enterabs(clock.time() + 60, report, ('first',))
+        >>> scheduler.run_until(clock.time() + 1800)
+        first 08:01:00
+        rescheduled 08:01:30
+        >>> clock.now().time()
+        datetime.time(8, 30)
+    """
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._sched = sched.scheduler(timefunc=clock.time, delayfunc=clock.sleep)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        for event in self._sched.queue:
+            self.cancel(event)
+
+    def enterabs(self, timestamp, action, argument=()):
+        """ Schedules the call of action with the given arguments at the given timestamp and returns the event. """
+        return self._sched.enterabs(timestamp, 1, action, argument=argument)
+
+    def cancel(self, event):
+        try:
+            self._sched.cancel(event)
+        except ValueError:
+            pass  # The event is being run
+
+    def run_until(self, timestamp):
+        """ Runs all the events scheduled until the given timestamp, including those they schedule meanwhile. """
+        while True:
+            queue = self._sched.queue
+            if not queue or queue[0].time > timestamp:
+                break
+            self._clock.advance_to(queue[0].time)
+            self._sched.run(blocking=False)
+        self._clock.advance_to(timestamp)
+
+
+class ScheduledEvent(object):
+    """ An event of the AsyncioScheduler, ordered by timestamp and insertion order. """
+
+    __slots__ = ('time', 'sequence', 'action', 'argument', 'cancelled')
+
+    def __init__(self, timestamp, sequence, action, argument):
+        self.time = timestamp
+        self.sequence = sequence
+        self.action = action
+        self.argument = argument
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.time, self.sequence) < (other.time, other.sequence)
+
+    def __repr__(self):
+        return '%s(time=%s, action=%s)' % (self.__class__.__qualname__, self.time, self.action)
+
+
+class AsyncioScheduler(object):
+    """
+        A scheduler running an asyncio event loop in a dedicated thread.
+        Once started, a single timer is armed for the earliest event and re-armed whenever the queue changes, so that
+        events fire at their exact timestamp. Actions are run in the default executor of the loop, while the loop
+        itself is exposed to run the coroutine functions of the switch modules concurrently.
+    """
+
+    max_timer_delay = 60  # The timer is re-armed at least every minute to follow wall-clock adjustments.
+
+    def __init__(self, timefunc=time.time):
+        self._timefunc = timefunc
+        self._queue = []
+        self._queue_lock = Lock()
+        self._sequence = itertools.count()
+        self._timer = None
+        self._started = False
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run, name='switch.py-scheduler', daemon=True)
+        self._thread.start()
+
+    def start(self):
+        self._started = True
+        self.loop.call_soon_threadsafe(self._arm_timer)
+
+    def stop(self):
+        self._started = False
+        with self._queue_lock:
+            for event in self._queue:
+                event.cancelled = True
+            self._queue = []
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def enterabs(self, timestamp, action, argument=()):
+        """ Schedules the call of action with the given arguments at the given timestamp and returns the event. """
+        event = ScheduledEvent(timestamp, next(self._sequence), action, argument)
+        with self._queue_lock:
+            heapq.heappush(self._queue, event)
+            earliest = self._queue[0] is event
+        if earliest and self._started:
+            self.loop.call_soon_threadsafe(self._arm_timer)
+        return event
+
+    def cancel(self, event):
+        with self._queue_lock:
+            event.cancelled = True
+            earliest = self._queue and self._queue[0] is event
+        if earliest and self._started:
+            self.loop.call_soon_threadsafe(self._arm_timer)
+
+    def _arm_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        with self._queue_lock:
+            while self._queue and self._queue[0].cancelled:
+                heapq.heappop(self._queue)
+            if not self._queue:
+                return
+            delay = self._queue[0].time - self._timefunc()
+        self._timer = self.loop.call_later(min(max(delay, 0), self.max_timer_delay), self._fire_events)
+
+    def _fire_events(self):
+        self._timer = None
+        now = self._timefunc()
+        with self._queue_lock:
+            due_events = []
+            while self._queue and self._queue[0].time <= now:
+                event = heapq.heappop(self._queue)
+                if not event.cancelled:
+                    due_events.append(event)
+        for event in due_events:
+            self.loop.run_in_executor(None, event.action, *event.argument).add_done_callback(self._log_failure)
+        self._arm_timer()
+
+    @staticmethod
+    def _log_failure(future):
+        if future.exception() is not None:
+            logger.error('A scheduled event failed', exc_info=future.exception(), extra=dict(context='General'))
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+schedulers = {
+    'thread': lambda clock: ThreadedScheduler(timefunc=clock.time),
+    'asyncio': lambda clock: AsyncioScheduler(timefunc=clock.time),
+    'simulation': lambda clock: SimulatedScheduler(clock),
+}
+
+
+def get_scheduler(name, clock):
+    """ Returns a new scheduler of the given backend, either thread, asyncio or simulation, following the clock. """
+    if name not in schedulers:
+        raise ValueError('Unknown scheduler backend %s, expected one of %s' % (name, ', '.join(schedulers)))
+    return schedulers[name](clock)
@@ -4,105 +4,443 @@
 #
 
 
-import json
-import os
-import sched
+import atexit
+import heapq
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from importlib import import_module
-from threading import Thread
-
-import time
+from threading import RLock, Thread
+from types import MappingProxyType
 
 from switch import join_root
-from switch.time.schedule import Schedule
+from switch.actuator import Actuator
+from switch.persistence import JsonStateStore
+from switch.scheduler import get_scheduler
+from switch.time.clock import get_clock
+from switch.time.schedule import load_schedule
 from switch.log import app_logger as logger
+from switch.metrics import event_delay_seconds, next_action_seconds, save_seconds
 
 
 class SwitchManager(object):
-    """ A singleton class interfacing switches with the application. """
+    """
+        A singleton class interfacing switches with the application.
+        Unless start is False, the switches are actuated to their stored levels and the scheduler is started once they
+        are loaded, otherwise the start method must be called.
+    """
+
+    startup_batch_size = 32  # Number of switches actuated at once when starting, between two updates of the progress.
 
-    def __init__(self, switch_definitions):
+    def __init__(self, switch_definitions, scheduler='thread', actuation_workers=4, actuation_timeout=10,
+                 state_store=None, event_bus=None, resync_interval=None, start=True):
         self._switches = switch_definitions
         self._modules = {}
+        self._drivers = {}
         self._schedules = {}
+        self._references = {}
         self._states = {}
+        self._confirmed_levels = {}
+        self._actuation_stats = {'issued': 0, 'skipped': 0, 'failed': 0, 'resyncs': 0}
+        self._resync_interval = resync_interval
+        self._snapshots = {}
+        self._versions = {}
+        self._version_counter = itertools.count(1)
+        self.version = 0
+        self._clock = get_clock()
+        self._scheduler = get_scheduler(scheduler, self._clock)
+        self._actuator = Actuator(workers=actuation_workers, timeout=actuation_timeout,
+                                  loop=getattr(self._scheduler, 'loop', None))
+        self._store = state_store or JsonStateStore(join_root('data'))
+        self._bus = event_bus
+        atexit.register(self._store.close)
         logger.debug('Proceeding to load switches', extra=dict(context='General'))
+        # The switch modules are imported while the stored data is read.
+        module_names = {attrs['module'] for attrs in switch_definitions.values()}
+        with ThreadPoolExecutor(thread_name_prefix='switch.py-startup') as executor:
+            templates_data = executor.submit(self._store.load_templates)
+            switches_data = executor.submit(self._store.load, list(switch_definitions))
+            modules = {name: executor.submit(import_module, name if '.' in name else 'switch.switches.%s' % name)
+                       for name in module_names}
+            templates_data, switches_data = templates_data.result(), switches_data.result()
+            modules = {name: future.result() for name, future in modules.items()}
+        self._templates = {name: load_schedule(template_dict).freeze()
+                           for name, template_dict in templates_data.items()}
         for switch in switch_definitions:
             self._states[switch] = {'level': 0, 'mode': 0}
-            self._modules[switch] = import_module('switch.switches.%s' % self._switches[switch]['module'])
-            self._load_switch(switch)
-            logger.debug('\nstate: %s\nschedules: %s', self._states[switch], self._schedules[switch], extra=dict(context=switch))
-        logger.debug('Proceeding to start scheduler', extra=dict(context='General'))
-        self._running = True
+            self._modules[switch] = modules[self._switches[switch]['module']]
+            self._load_switch(switch, switches_data.get(switch))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('\nstate: %s\nschedules: %s', self._states[switch], self._schedules[switch],
+                             extra=dict(context=switch))
+        self._open_drivers()
+        self._stored_switches = [switch for switch in switch_definitions if switch in switches_data]
+        self._startup = {'ready': False, 'switches': len(self._stored_switches), 'synced': 0, 'failed': 0}
         self._next_event = None
-        self._sched = sched.scheduler(timefunc=time.time)
-        self._sched_thread = Thread(target=self._run_sched)
-        self._schedule_next_event()
-        self._sched_thread.start()
+        self._events = []
+        self._event_entries = {}
+        self._events_lock = RLock()
+        with self._events_lock:
+            for switch in switch_definitions:
+                self._update_event(switch)
+            self._schedule_next_event()
+        if resync_interval:
+            self._scheduler.enterabs(self._clock.time() + resync_interval, self._periodic_resync)
+        if start:
+            self.start()
+
+    def start(self, background=False):
+        """
+            Actuates the switches having stored data to their stored levels, then starts the scheduler, which handles
+            at once the events due meanwhile. With background set, this is done by a thread, e.g. while the web
+            server already serves requests, and startup_progress tells how far it went.
+        """
+        if background:
+            Thread(target=self._start, name='switch.py-startup', daemon=True).start()
+        else:
+            self._start()
 
-    def _load_switch(self, switch_id):
+    def _start(self):
+        try:
+            for i in range(0, len(self._stored_switches), self.startup_batch_size):
+                # Switches actuated in the meantime, e.g. through the API, already have a confirmed level.
+                levels = {switch: self._states[switch]['level']
+                          for switch in self._stored_switches[i:i + self.startup_batch_size]
+                          if switch not in self._confirmed_levels}
+                results = self.set_levels(levels)
+                self._startup['failed'] += sum(1 for error in results.values() if error is not None)
+                self._startup['synced'] = min(i + self.startup_batch_size, len(self._stored_switches))
+        except Exception:
+            logger.exception('Could not actuate the switches to their stored levels', extra=dict(context='General'))
+        logger.debug('Proceeding to start scheduler', extra=dict(context='General'))
+        self._scheduler.start()
+        self._startup['ready'] = True
+
+    @property
+    def startup_progress(self):
+        """ Returns whether the manager is ready, and the numbers of switches to actuate, actuated and failed. """
+        return dict(self._startup)
+
+    def _open_drivers(self):
+        """ Creates and opens one driver per module defining a Driver class and per controller of its switches. """
+        groups = {}
+        for switch, module in self._modules.items():
+            if hasattr(module, 'Driver'):
+                key = module, self._switches[switch].get('controller')
+                groups.setdefault(key, {})[switch] = self._switches[switch]
+        drivers = [module.Driver(controller, switches) for (module, controller), switches in groups.items()]
+        if drivers:
+            with ThreadPoolExecutor(thread_name_prefix='switch.py-startup') as executor:
+                opened = [(driver, executor.submit(driver.open)) for driver in drivers]
+            for driver, future in opened:
+                if future.exception() is not None:
+                    logger.error('Could not open the driver', exc_info=future.exception(),
+                                 extra=dict(context=driver.name))
+                for switch in driver.switches:
+                    self._drivers[switch] = driver
+        atexit.register(self._close_drivers)
+
+    def _close_drivers(self):
+        for driver in set(self._drivers.values()):
+            try:
+                driver.close()
+            except Exception:
+                logger.exception('Could not close the driver', extra=dict(context=driver.name))
+        self._drivers.clear()
+
+    def _load_switch(self, switch_id, switch_data):
         self._schedules[switch_id] = {}
-        switch_data_path = self._get_switch_data_path(switch_id)
-        if os.path.exists(switch_data_path):
-            with open(switch_data_path, 'r') as f:
-                switch_data = json.load(f)
-                schedules_data = switch_data.pop('schedules')
-                self._states[switch_id] = switch_data
-                for schedule_name, schedule_dict in schedules_data.items():
-                    self._schedules[switch_id][schedule_name] = Schedule.from_dict(schedule_dict)
-                self.set_level(switch_id, self._states[switch_id]['level'])
+        self._references[switch_id] = {}
+        if switch_data:
+            schedules_data = switch_data.pop('schedules')
+            self._states[switch_id] = switch_data
+            for schedule_name, schedule_dict in schedules_data.items():
+                if 'template' not in schedule_dict:
+                    self._schedules[switch_id][schedule_name] = load_schedule(schedule_dict)
+                elif schedule_dict['template'] in self._templates:
+                    self._references[switch_id][schedule_name] = schedule_dict['template']
+                    self._schedules[switch_id][schedule_name] = self._templates[schedule_dict['template']]
+                else:
+                    logger.error('Schedule %s uses the unknown template %s', schedule_name, schedule_dict['template'],
+                                 extra=dict(context=switch_id))
+            if switch_data.get('active_schedule') not in self._schedules[switch_id]:
+                switch_data.pop('active_schedule', None)
 
     def save_switch(self, switch_id):
-        switch_data_path = self._get_switch_data_path(switch_id)
-        with open(switch_data_path, 'w') as f:
+        self.save_switches([switch_id])
+
+    def save_switches(self, switch_ids):
+        """ Stores the states and the schedules of the given switches at once in the state store. """
+        switches_data = {}
+        for switch_id in switch_ids:
             switch_data = dict(**self._states[switch_id])
-            switch_data['schedules'] = {schedule_name: schedule.to_dict()
+            references = self._references[switch_id]
+            switch_data['schedules'] = {schedule_name: {'template': references[schedule_name]}
+                                        if schedule_name in references else schedule.to_dict()
                                         for schedule_name, schedule in self._schedules[switch_id].items()}
-            json.dump(switch_data, f)
+            switches_data[switch_id] = switch_data
+            self._mark_changed(switch_id)
+        with save_seconds.time():
+            self._store.save(switches_data)
+
+    def _mark_changed(self, switch_id):
+        """ Gives a new version to the switch, so that its snapshot is rebuilt when next accessed. """
+        self._versions[switch_id] = self.version = next(self._version_counter)
+
+    def get_version(self, switch_id):
+        """ Returns the version of the switch, which changes whenever its state, schedules or next action change. """
+        return self._versions.get(switch_id, 0)
+
+    def flush(self):
+        """ Writes the pending changes of the switches to the state store. """
+        self._store.flush()
+
+    @property
+    def scheduler(self):
+        """ Returns the scheduler backend, e.g. to run the events of the simulation scheduler in virtual time. """
+        return self._scheduler
+
+    @property
+    def actuation_stats(self):
+        """ Returns the numbers of actuations issued, skipped as the switch already had the level, failed and resyncs. """
+        return dict(self._actuation_stats)
+
+    @property
+    def persistence_stats(self):
+        """ Returns the counters of the state store, e.g. the numbers of writes performed and coalesced. """
+        return self._store.stats
 
     def add_schedule(self, switch, schedule_name, schedule):
         self._schedules[switch][schedule_name] = schedule
+        self._references[switch].pop(schedule_name, None)
         self.save_switch(switch)
 
     def delete_schedule(self, switch, schedule_name):
         self._schedules[switch].pop(schedule_name)
+        self._references[switch].pop(schedule_name, None)
         if schedule_name == self._states[switch].get('active_schedule'):
             self._states[switch].pop('active_schedule')
         self.save_switch(switch)
-        self._schedule_next_event()
+        self._reschedule(switch)
 
     def use_schedule(self, switch, schedule_name):
         if schedule_name in self._schedules[switch]:
             self._states[switch]['active_schedule'] = schedule_name
-            current_level, _ = self._schedules[switch][schedule_name].get_current_action()
-            self.set_level(switch, current_level or 0)
+            self._publish('schedule', {'switch': switch, 'active_schedule': schedule_name})
+            self.set_levels({switch: self._get_scheduled_level(switch)}, changed=[switch])
+            self._reschedule(switch)
+
+    def update_schedules(self, operations):
+        """
+            Applies the given list of (switch, action, schedule name, schedule) operations at once, where action is
+            add, replace or activate, the schedule being None for the latter. The schedule to add or replace may also
+            be the name of a template, the switch then sharing the template schedule. The operations of a switch are
+            applied in order and all or none of them, each changed switch being stored once and the event queue updated
+            once.
+            The switches in automated mode whose active schedule changed are set to the level of its current action.
+            Returns a dict associating each switch with None or with the exception making its operations fail.
+        """
+        changes = {}
+        results = {}
+        for switch, action, schedule_name, schedule in operations:
+            if results.get(switch) is not None:
+                continue
+            try:
+                if switch not in self._switches:
+                    raise KeyError('Unknown switch %s' % switch)
+                change = changes.setdefault(switch, {'schedules': dict(self._schedules[switch]),
+                                                     'references': dict(self._references[switch]),
+                                                     'active_schedule': self._states[switch].get('active_schedule'),
+                                                     'active_changed': False})
+                schedules, references = change['schedules'], change['references']
+                if action == 'add' or action == 'replace':
+                    if action == 'add' and schedule_name in schedules:
+                        raise ValueError('Schedule %s already exists' % schedule_name)
+                    if isinstance(schedule, str):
+                        if schedule not in self._templates:
+                            raise KeyError('Unknown template %s' % schedule)
+                        references[schedule_name] = schedule
+                        schedules[schedule_name] = self._templates[schedule]
+                    else:
+                        references.pop(schedule_name, None)
+                        schedules[schedule_name] = schedule
+                    change['active_changed'] |= schedule_name == change['active_schedule']
+                elif action == 'activate':
+                    if schedule_name not in schedules:
+                        raise KeyError('Unknown schedule %s' % schedule_name)
+                    change['active_schedule'] = schedule_name
+                    change['active_changed'] = True
+                else:
+                    raise ValueError('Unknown schedule operation %s' % action)
+                results[switch] = None
+            except (KeyError, ValueError) as e:
+                results[switch] = e
+                changes.pop(switch, None)
+
+        levels = {}
+        for switch, change in changes.items():
+            self._schedules[switch] = change['schedules']
+            self._references[switch] = change['references']
+            if change['active_schedule'] != self._states[switch].get('active_schedule'):
+                self._states[switch]['active_schedule'] = change['active_schedule']
+                self._publish('schedule', {'switch': switch, 'active_schedule': change['active_schedule']})
+            if change['active_changed'] and self._states[switch]['mode'] == 0:
+                levels[switch] = self._get_scheduled_level(switch)
+        self.set_levels(levels, changed=changes)
+        with self._events_lock:
+            for switch in changes:
+                self._update_event(switch)
+            self._schedule_next_event()
+        return results
+
+    def get_templates(self):
+        """ Returns a read-only dict associating the names of the schedule templates with their shared schedules. """
+        return MappingProxyType(dict(self._templates))
+
+    def set_template(self, template_name, schedule):
+        """
+            Creates or replaces the schedule template with the given name by a frozen copy of the given schedule.
+            The switches using the template are updated at once, and the list of their ids is returned.
+        """
+        template = self._templates[template_name] = schedule.copy().freeze()
+        self._save_templates()
+        switches = set()
+        levels = {}
+        for switch, references in self._references.items():
+            for schedule_name, reference in references.items():
+                if reference == template_name:
+                    self._schedules[switch][schedule_name] = template
+                    switches.add(switch)
+                    state = self._states[switch]
+                    if state.get('active_schedule') == schedule_name and state['mode'] == 0:
+                        levels[switch] = self._get_scheduled_level(switch)
+        if levels:
+            self.set_levels(levels)
+        with self._events_lock:
+            for switch in switches:
+                self._update_event(switch)
             self._schedule_next_event()
+        return sorted(switches)
+
+    def delete_template(self, template_name):
+        """ Deletes the schedule template with the given name, which must not be used by any switch. """
+        users = [switch for switch, references in self._references.items() if template_name in references.values()]
+        if users:
+            raise ValueError('Template %s is used by %s' % (template_name, ', '.join(sorted(users))))
+        del self._templates[template_name]
+        self._save_templates()
+
+    def _save_templates(self):
+        self.version = next(self._version_counter)
+        self._store.save_templates({name: template.to_dict() for name, template in self._templates.items()})
 
     def switch_mode(self, switch, mode, level):
         self._states[switch]['mode'] = mode
+        self._publish('mode', {'switch': switch, 'mode': mode})
         if mode == 0:
             self.use_schedule(switch, self._states[switch].get('active_schedule'))
         else:
-            self.set_level(switch, level)
-        self._schedule_next_event()
+            self.set_levels({switch: level}, changed=[switch])
+        self._reschedule(switch)
 
     def set_level(self, switch, level):
-        self._states[switch]['level'] = level
-        if level > 0:
-            self._modules[switch].on(switch, level)
-        else:
-            self._modules[switch].off(switch)
-        self.save_switch(switch)
-        logger.info('New level=%d', level, extra=dict(context=switch))
+        self.set_levels({switch: level})
+
+    def set_levels(self, levels, changed=(), force=False):
+        """
+            Sets the level of each switch of the given dict, the switches being actuated concurrently.
+            The switches sharing a driver are given to it in a single batch, i.e. one command per controller.
+            A switch whose hardware already confirmed the level is not actuated again unless force is set, and only
+            the switches whose level changed are stored, along with the given changed switches.
+            Returns a dict associating each switch with None or with the exception raised by its actuation.
+        """
+        actuations = []
+        batches = {}
+        updated = [switch for switch, level in levels.items() if self._states[switch]['level'] != level]
+        issued = {}
+        for switch, level in levels.items():
+            self._states[switch]['level'] = level
+            if not force and self._confirmed_levels.get(switch) == level:
+                continue
+            issued[switch] = level
+            if switch in self._drivers:
+                batches.setdefault(self._drivers[switch], {})[switch] = level
+            elif level > 0:
+                actuations.append((switch, self._modules[switch].on, (switch, level)))
+            else:
+                actuations.append((switch, self._modules[switch].off, (switch,)))
+        for driver, batch in batches.items():
+            actuations.append((driver.name, driver.set_levels, (batch,)))
+        results = self._actuator.actuate(actuations) if actuations else {}
+        for driver, batch in batches.items():
+            error = results.pop(driver.name, None)
+            results.update(dict.fromkeys(batch, error))
+        for switch, level in issued.items():
+            if results.get(switch) is None:
+                self._confirmed_levels[switch] = level
+            else:
+                # The level of the hardware is unknown until an actuation succeeds.
+                self._confirmed_levels.pop(switch, None)
+                self._actuation_stats['failed'] += 1
+        self._actuation_stats['issued'] += len(issued)
+        self._actuation_stats['skipped'] += len(levels) - len(issued)
+        saved = set(updated).union(changed)
+        if saved:
+            self.save_switches(saved)
+        for switch, level in levels.items():
+            results.setdefault(switch, None)
+            if switch not in updated and results[switch] is None:
+                continue
+            logger.info('New level=%d', level, extra=dict(context=switch))
+            self._publish('level', {'switch': switch, 'level': level, 'version': self.get_version(switch),
+                                    'error': str(results[switch]) if results.get(switch) else None})
+        return results
+
+    def resync(self):
+        """ Actuates every switch to its current level, e.g. in case a switch was operated by hand. """
+        logger.debug('Resynchronizing the switches', extra=dict(context='General'))
+        self._actuation_stats['resyncs'] += 1
+        return self.set_levels({switch: self._states[switch]['level'] for switch in self._switches}, force=True)
+
+    def _periodic_resync(self):
+        try:
+            self.resync()
+        finally:
+            self._scheduler.enterabs(self._clock.time() + self._resync_interval, self._periodic_resync)
+
+    def _publish(self, event_type, data):
+        if self._bus is not None:
+            self._bus.publish(event_type, data)
+
+    def _get_scheduled_level(self, switch):
+        """ Returns the level set by the current action of the active schedule of the switch. """
+        current_action = self._schedules[switch][self._states[switch]['active_schedule']].get_current_action()
+        return (current_action[0] if current_action else None) or 0
 
     def __iter__(self):
         return iter([self[switch_id] for switch_id in self._switches])
 
     def __getitem__(self, switch_id):
-        attrs = self._switches.get(switch_id)
-        if not attrs:
+        """
+            Returns a read-only snapshot of the attributes, the state, the schedules and the next action of the switch.
+            The snapshot is rebuilt only when the switch changed or its next action is due.
+        """
+        if switch_id not in self._switches:
             return None
+        version = self.get_version(switch_id)
+        cached = self._snapshots.get(switch_id)
+        if cached is None or cached[0] != version or (cached[1] is not None and cached[1] <= self._clock.now()):
+            snapshot = self._build_snapshot(switch_id)
+            cached = version, snapshot['next_action'][1] if 'next_action' in snapshot else None, snapshot
+            self._snapshots[switch_id] = cached
+        return cached[2]
+
+    def _build_snapshot(self, switch_id):
+        attrs = self._switches[switch_id]
         switch_dict = {'id': switch_id, 'name': attrs['name'], 'levels': attrs['levels'],
-                       'schedules': self._schedules[switch_id]}
+                       'schedules': MappingProxyType(dict(self._schedules[switch_id])),
+                       'schedule_templates': MappingProxyType(dict(self._references[switch_id]))}
         switch_dict.update(self._states[switch_id])
         active_schedule = switch_dict.get('active_schedule')
         if active_schedule and switch_dict['mode'] < 3:
@@ -110,33 +448,68 @@ class SwitchManager(object):
             if next_action:
                 level, date = next_action
                 switch_dict['next_action'] = (level or 0, date)
-        return switch_dict
+        return MappingProxyType(switch_dict)
 
     def __contains__(self, item):
-        return self[item] is not None
+        return item in self._switches
 
     def __del__(self):
-        self._running = False
-        self._cancel_events()
+        self._scheduler.stop()
+        self._actuator.shutdown()
+        self._close_drivers()
+        self._store.close()
+
+    def _get_forecast_schedule(self, switch):
+        """ Returns the schedule driving the switch in the future, or None if its level will not change. """
+        state = self._states[switch]
+        return self._schedules[switch].get(state.get('active_schedule')) if state['mode'] < 3 else None
+
+    def forecast(self, start, end=None, switches=None):
+        """
+            Lazily yields a tuple (datetime, switch, level) for each transition of the given switches, all by default,
+            from the start datetime and before the end datetime, or forever if end is None, in time order.
+            The switches in automated or temporary modes are assumed to follow their active schedule from start on.
+        """
+        def switch_transitions(switch, schedule):
+            for date, level in schedule.iter_transitions(start, end):
+                yield date, switch, level or 0
+
+        transitions = []
+        for switch in switches or self._switches:
+            schedule = self._get_forecast_schedule(switch)
+            if schedule is not None:
+                transitions.append(switch_transitions(switch, schedule))
+        return heapq.merge(*transitions)
+
+    def forecast_usage(self, start, end, switches=None):
+        """
+            Returns a dict associating the given switches, all by default, with their usage between the start and end
+            datetimes, under the assumptions of forecast. A usage is a dict of the on_time timedelta during which the
+            level is above 0 and of the energy, the level integrated in hours and multiplied by the power of the switch.
+        """
+        usages = {}
+        for switch in switches or self._switches:
+            schedule = self._get_forecast_schedule(switch)
+            if schedule is not None:
+                on_time, level_time = schedule.get_usage(start, end)
+            else:
+                level = self._states[switch]['level']
+                on_time = (end - start).total_seconds() if level else 0
+                level_time = (end - start).total_seconds() * level
+            usages[switch] = {'on_time': timedelta(seconds=on_time),
+                              'energy': level_time / 3600 * self._switches[switch].get('power', 1)}
+        return usages
 
     def determine_next_actions(self):
-        actions = [self.determine_next_action_for(switch) for switch in self._states]
-        actions = filter(lambda x: x is not None, actions)
-
-        earliest_actions = []
-        instant = None
-        for action in actions:
-            switch, weight, datetime = action
-            if not earliest_actions:
-                earliest_actions.append((switch, weight, datetime))
-                instant = datetime
-            elif datetime < instant:
-                earliest_actions = [(switch, weight, datetime)]
-                instant = datetime
-            elif datetime == instant:
-                earliest_actions.append((switch, weight, datetime))
-
-        return earliest_actions, instant
+        """ Returns the list of the earliest pending actions (switch, weight, datetime) and their datetime. """
+        with self._events_lock:
+            self._discard_cancelled_events()
+            if not self._events:
+                return [], None
+            timestamp = self._events[0][0]
+            earliest_actions = [(switch, weight, datetime) for t, switch, weight, datetime, valid in self._events
+                                if t == timestamp and valid]
+            return earliest_actions, earliest_actions[0][2]
 
     def determine_next_action_for(self, switch):
         state = self._states[switch]
@@ -149,31 +522,79 @@ class SwitchManager(object):
             pass
         return None
 
-    def _cancel_events(self):
-        if self._sched.queue:
-            map(self._sched.cancel, self._sched.queue)
+    def _update_event(self, switch):
+        """ Replaces the pending event of the given switch in the event queue by its next action, if any. """
+        self._mark_changed(switch)
+        with self._events_lock:
+            entry = self._event_entries.pop(switch, None)
+            if entry:
+                entry[-1] = False  # Cancelled entries are discarded when they reach the top of the queue
+            with next_action_seconds.time():
+                action = self.determine_next_action_for(switch)
+            if action:
+                _, weight, datetime = action
+                entry = [datetime.timestamp(), switch, weight, datetime, True]
+                self._event_entries[switch] = entry
+                heapq.heappush(self._events, entry)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('Next action is level=%d on %s', weight, datetime, extra=dict(context=switch))
+
+    def _discard_cancelled_events(self):
+        while self._events and not self._events[0][-1]:
+            heapq.heappop(self._events)
+
+    def _reschedule(self, switch):
+        with self._events_lock:
+            self._update_event(switch)
+            self._schedule_next_event()
 
     def _schedule_next_event(self):
-        self._cancel_events()
-        actions, datetime = self.determine_next_actions()
-        if actions:
-            self._next_event = self._sched.enterabs(datetime.timestamp(), 1, self._handle_event, argument=(actions,))
-            logger.info('Next scheduled event is %s and will affect switches %s', datetime,
-                        [switch for switch, _, _ in actions], extra=dict(context='General'))
-
-    def _handle_event(self, actions):
+        """ Ensures that the scheduler will wake up for the earliest event of the queue. """
+        with self._events_lock:
+            self._discard_cancelled_events()
+            timestamp = self._events[0][0] if self._events else None
+            if self._next_event is not None:
+                if self._next_event.time == timestamp:
+                    return
+                self._scheduler.cancel(self._next_event)
+                self._next_event = None
+            if timestamp is not None:
+                self._next_event = self._scheduler.enterabs(timestamp, self._handle_event)
+                logger.info('Next scheduled event is %s', self._events[0][3], extra=dict(context='General'))
+
+    def _pop_due_events(self, now):
+        """ Removes all the events of the queue that are due at the given timestamp and returns their actions. """
+        actions = []
+        with self._events_lock:
+            self._discard_cancelled_events()
+            while self._events and self._events[0][0] <= now:
+                timestamp, switch, weight, _, _ = heapq.heappop(self._events)
+                del self._event_entries[switch]
+                event_delay_seconds.observe(now - timestamp)
+                actions.append((switch, weight))
+                self._discard_cancelled_events()
+        return actions
+
+    def _handle_event(self):
         logger.debug('A scheduled event expired', extra=dict(context='General'))
-        for switch, level, _ in actions:
+        now = self._clock.time()
+        with self._events_lock:
+            if self._next_event is not None and self._next_event.time <= now:
+                self._next_event = None
+            actions = self._pop_due_events(now)
+        levels = {}
+        changed = []
+        for switch, _ in actions:
             state = self._states[switch]
             if state['mode'] < 3:
-                self.switch_mode(switch, 0, level)
-        self._schedule_next_event()
-
-    def _run_sched(self):
-        while self._running:
-            self._sched.run()
-            time.sleep(5)
-
-    @staticmethod
-    def _get_switch_data_path(switch_id):
-        return join_root(os.path.join('data', switch_id + os.extsep + 'json'))
+                if state['mode'] != 0:
+                    state['mode'] = 0
+                    changed.append(switch)
+                    self._publish('mode', {'switch': switch, 'mode': 0})
+                if state.get('active_schedule') in self._schedules[switch]:
+                    levels[switch] = self._get_scheduled_level(switch)
+        self.set_levels(levels, changed=changed)
+        with self._events_lock:
+            for switch, _ in actions:
+                self._update_event(switch)
+            self._schedule_next_event()
@@ -9,4 +9,8 @@
             pass    
             
     Those functions will be called when the switch changes states and should effectively actuate it.
+
+    A module may instead define a Driver class, subclassing switch.driver.Driver, to control all the switches sharing
+    the same controller attribute at once through persistent connections. See the tcp_relay module for an example.
+    Modules outside of this package can be used by giving their full path, e.g. mypackage.my_switch.
 """
@@ -0,0 +1,88 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+"""
+    A driver for relay boards controlled over TCP with a line-based protocol, e.g. for the switches::
+
+        heater:
+          module: tcp_relay
+          controller: 192.168.1.20:5000  # The address of the relay board.
+          relay: 3  # The relay driving this switch on the board, its name by default.
+
+    The levels of all the relays changing at once are sent as a single command ``SET 3=1 4=0``, to which the board
+    answers ``OK`` or an error message on its own line. Connections to a board are kept open in a pool.
+"""
+
+import socket
+
+from switch.driver import Driver as BaseDriver, ConnectionPool, DriverError
+
+
+class RelayConnection(object):
+    def __init__(self, address, timeout):
+        self._socket = socket.create_connection(address, timeout=timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile('rb')
+
+    def send_command(self, command):
+        self._socket.sendall(command.encode() + b'\n')
+        reply = self._reader.readline().decode().strip()
+        if not reply:
+            raise ConnectionError('The connection was closed by the controller')
+        if reply != 'OK':
+            raise DriverError(reply)
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+
+class Driver(BaseDriver):
+    """
+        Sends the levels of the relays of a board in a single command over a pooled connection.
+        A command is sent once more on a new connection if the board closed the one of the pool.
+
+        >>> from benchmarks.relay_server import RelayServer
+        >>> board = RelayServer().start()
+        >>> driver = Driver(board.controller, {'heater': {'relay': '3'}, 'pump': {}})
+        >>> driver.open()
+        >>> driver.set_levels({'heater': 1, 'pump': 0})
+        >>> board.levels, board.commands
+        ({'3': 1, 'pump': 0}, 1)
+        >>> board.close_connections()
+        >>> driver.set_levels({'heater': 0})
+        >>> board.levels['3'], board.commands, board.connections
+        (0, 2, 2)
+        >>> board.failure = 'ERROR relay 3 is stuck'
+        >>> driver.set_levels({'heater': 1})
+        Traceback (most recent call last):
+        switch.driver.DriverError: ERROR relay 3 is stuck
+        >>> board.levels['3']
+        0
+        >>> driver.close()
+        >>> board.shutdown()
+        >>> board.server_close()
+    """
+
+    pool_size = 2
+    timeout = 5
+
+    def open(self):
+        host, port = self.controller.rsplit(':', 1)
+        self._pool = ConnectionPool(lambda: RelayConnection((host, int(port)), self.timeout), size=self.pool_size)
+
+    def close(self):
+        self._pool.close()
+
+    def set_levels(self, levels):
+        relays = ' '.join('%s=%d' % (self.switches[switch].get('relay', switch), level)
+                          for switch, level in levels.items())
+        try:
+            with self._pool.connection() as connection:
+                connection.send_command('SET ' + relays)
+        except ConnectionError:
+            # The controller may have closed an idle connection of the pool, the command is sent once more.
+            with self._pool.connection() as connection:
+                connection.send_command('SET ' + relays)
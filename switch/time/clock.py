@@ -0,0 +1,69 @@
+#
+# This file is part of switch.py. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+#
+
+
+import time
+from datetime import datetime
+from threading import Lock
+
+
+class SystemClock(object):
+    """ The clock of the system, used by default. """
+
+    @staticmethod
+    def time():
+        return time.time()
+
+    @staticmethod
+    def now():
+        return datetime.now()
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock(object):
+    """
+        A virtual clock starting at the given datetime, now by default, and only moving forward when told to.
+        Sleeping advances it immediately, so that a scheduler using it runs its events as fast as they can be handled.
+
+        >>> clock = SimulatedClock(datetime(2017, 1, 2, 8, 0))
+        >>> clock.sleep(90)
+        >>> clock.now()
+        datetime.datetime(2017, 1, 2, 8, 1, 30)
+    """
+
+    def __init__(self, start=None):
+        self._time = (start or datetime.now()).timestamp()
+        self._lock = Lock()
+
+    def time(self):
+        return self._time
+
+    def now(self):
+        return datetime.fromtimestamp(self._time)
+
+    def sleep(self, seconds):
+        self.advance_to(self._time + seconds)
+
+    def advance_to(self, timestamp):
+        """ Moves the clock to the given timestamp, unless it is already past it. """
+        with self._lock:
+            self._time = max(self._time, timestamp)
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    """ Returns the clock giving the current time to the time package and to the switch manager. """
+    return _clock
+
+
+def set_clock(clock):
+    """ Replaces the current clock, e.g. by a SimulatedClock to replay schedules in virtual time. """
+    global _clock
+    _clock = clock
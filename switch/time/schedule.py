@@ -4,9 +4,22 @@
 #
 
 
+from array import array
+from bisect import bisect_left, bisect_right
 from datetime import timedelta, datetime, date, time
+from itertools import groupby
 
-from switch.time.time_interval import WeightedTimeInterval, Instant
+from switch.time.time_interval import WeightedTimeInterval, Instant, week_start_of
+
+WEEK_SECONDS = 7 * 24 * 60 * 60
+SLOT_SECONDS = 15 * 60
+WEEK_SLOTS = WEEK_SECONDS // SLOT_SECONDS
+DAY_SLOTS = WEEK_SLOTS // 7
+
+
+def week_offset(i: Instant):
+    """ Returns the number of seconds elapsed since the start of the week at the given instant. """
+    return i.minutes * 60
 
 
 class Schedule(object):
@@ -28,17 +41,48 @@ class Schedule(object):
 
     def __init__(self, intervals=None):
         self._intervals = []
-        for i in intervals:
+        self._index = None
+        self._transitions = None
+        self._usage = None
+        self._frozen = False
+        for i in intervals or []:
             self.add_interval(i)
 
+    def freeze(self):
+        """
+            Prevents any further modification of the schedule, so that it can be shared, and returns it.
+
+            >>> s = Schedule([WeightedTimeInterval(Instant(0, 1, 0), Instant(0, 2, 0), w=1)]).freeze()
+            >>> s.empty()
+            Traceback (most recent call last):
+            ...
+            TypeError: A frozen schedule cannot be modified, copy it first
+            >>> s.copy().get_weight(Instant(0, 1, 30))
+            1
+        """
+        self._frozen = True
+        return self
+
+    def copy(self):
+        """ Returns a modifiable copy of the schedule. """
+        return Schedule(self._intervals)
+
+    def _ensure_modifiable(self):
+        if self._frozen:
+            raise TypeError('A frozen schedule cannot be modified, copy it first')
+
     def add_interval(self, new_interval: WeightedTimeInterval):
         """
             Adds the interval if it is not overlapping with any other interval.
             If both overlapping intervals have the same weight they will be merged into one.
         """
+        self._ensure_modifiable()
+        self._index = None
+        self._transitions = None
         for idx, interval in enumerate(self._intervals):
             if new_interval < interval:
                 self._intervals.insert(idx, new_interval)
+                return
             elif new_interval in interval:
                 return
             elif not new_interval > interval and new_interval.weight == interval.weight:
@@ -50,60 +94,154 @@ class Schedule(object):
         self._intervals.append(new_interval)
 
     def empty(self):
+        self._ensure_modifiable()
         self._intervals = []
+        self._index = None
+        self._transitions = None
+
+    def _get_index(self):
+        """
+            Returns the arrays (starts, ends, reach) holding the week offsets of the intervals, in the same order.
+            reach[k] is the largest end among the k first intervals, it is sorted even if intervals overlap and
+            allows to skip every interval ending before a given instant with a single bisection.
+            The index is built lazily and invalidated when the intervals change.
+        """
+        if self._index is None:
+            starts, ends, reach = array('l'), array('l'), array('l')
+            for interval in self._intervals:
+                starts.append(interval.start * 60)
+                ends.append(interval.end * 60)
+                reach.append(max(reach[-1], ends[-1]) if reach else ends[-1])
+            self._index = starts, ends, reach
+        return self._index
 
     def get_weight(self, i: Instant):
         """
             Returns the weight associated with the interval containing the given instant if one contains it,
             otherwise returns None
         """
-        for interval in self._intervals:
-            if i in interval:
-                return interval.weight
+        offset = week_offset(i)
+        starts, ends, reach = self._get_index()
+        for idx in range(bisect_left(reach, offset), len(starts)):
+            if starts[idx] > offset:
+                break
+            if offset <= ends[idx]:
+                return self._intervals[idx].weight
         return None
 
+    def _get_transitions(self):
+        """
+            Returns the transition table of the schedule as a tuple (offsets, levels, instants), sorted by week offset.
+            Each transition sets the level of the switch to levels[k] at offsets[k], None meaning the end of an
+            action. An interval ending at the start of another one only yields the transition to the latter.
+            The table is compiled lazily and invalidated when the intervals change.
+        """
+        if self._transitions is None:
+            transitions = {}
+            for interval in self._intervals:
+                transitions.setdefault(interval.end * 60 % WEEK_SECONDS, None)
+            for interval in self._intervals:
+                transitions[interval.start * 60 % WEEK_SECONDS] = interval.weight
+            offsets = array('l', sorted(transitions))
+            self._transitions = (offsets, [transitions[o] for o in offsets],
+                                 [Instant.from_minutes(o // 60) for o in offsets])
+        return self._transitions
+
     def get_current_action(self):
         """
             Returns a tuple (weight, datetime) where weight can be None (indicating the end of the previous action)
             representing the current action of the schedule. If the schedule is empty returns None.
         """
-        if not self._intervals:
+        offsets, levels, instants = self._get_transitions()
+        if not offsets:
             return None
 
-        now = Instant.now_to_instant()
-        for idx, interval in enumerate(self._intervals):
-            if now in interval:
-                return interval.weight, interval.a.to_datetime()
-            if now < interval:
-                previous_idx = (idx - 1) % len(self._intervals)
-                previous_instant = self._intervals[previous_idx].b.to_datetime()
-                if previous_idx > idx:
-                    previous_instant -= timedelta(weeks=1)
-                return None, previous_instant
-        return None, self._intervals[(idx - 1) % len(self._intervals)].b.to_datetime()
+        idx = bisect_right(offsets, week_offset(Instant.now_to_instant())) - 1
+        if idx < 0:
+            # The current action started during the previous week.
+            return levels[idx], instants[idx].to_datetime() - timedelta(weeks=1)
+        return levels[idx], instants[idx].to_datetime()
 
     def get_next_action(self):
         """
             Returns a tuple (weight, datetime) where weight can be None (indicating the end of the current action)
             representing the next action of the schedule. If the schedule is empty returns None.
         """
-        if not self._intervals:
+        offsets, levels, instants = self._get_transitions()
+        if not offsets:
             return None
 
-        now = Instant.now_to_instant()
-        for idx, interval in enumerate(self._intervals):
-            if now < interval:
-                return interval.weight, interval.a.to_datetime()
-            next_interval = self._intervals[(idx + 1) % len(self._intervals)]
-            if interval == next_interval:
-                next_interval = WeightedTimeInterval(interval.a + timedelta(weeks=1), interval.b + timedelta(weeks=1), interval.weight)
-            if now in interval and interval.b < next_interval.a:
-                # There is a gap between the current interval and the next one.
-                return None, interval.b.to_datetime()
-
-        if self.get_current_action()[0] is None:
-            return self._intervals[0].weight, self._intervals[0].a.to_datetime() + timedelta(weeks=1)
-        return None, self._intervals[-1].b.to_datetime()
+        idx = bisect_right(offsets, week_offset(Instant.now_to_instant()))
+        if idx == len(offsets):
+            # The next action will take place during the next week.
+            return levels[0], instants[0].to_datetime() + timedelta(weeks=1)
+        return levels[idx], instants[idx].to_datetime()
+
+    def iter_transitions(self, start, end=None):
+        """
+            Lazily yields a tuple (datetime, weight) for each transition of the schedule taking place from the start
+            datetime and before the end datetime, or forever if end is None. A weight of None ends the previous action.
+        """
+        offsets, levels, _ = self._get_transitions()
+        if not offsets:
+            return
+        week_start = week_start_of(start)
+        idx = bisect_left(offsets, (start - week_start).total_seconds())
+        while True:
+            for k in range(idx, len(offsets)):
+                moment = week_start + timedelta(seconds=offsets[k])
+                if end is not None and moment >= end:
+                    return
+                yield moment, levels[k]
+            idx = 0
+            week_start += timedelta(weeks=1)
+
+    def _get_usage_table(self):
+        """
+            Returns the tuple (transitions, cumulated, weekly) where cumulated[k] is the usage of the switch from the
+            start of the week until the k-th transition and weekly its usage over a whole week. A usage is a tuple
+            (seconds at a level above 0, sum of the levels over each second). It is rebuilt with the transitions.
+        """
+        transitions = self._get_transitions()
+        if self._usage is None or self._usage[0] is not transitions:
+            offsets, levels, _ = transitions
+            cumulated = []
+            on_time, level_time = 0, 0
+            previous_offset, previous_level = 0, (levels[-1] or 0) if levels else 0
+            for offset, level in zip(offsets, levels):
+                on_time += (offset - previous_offset) if previous_level else 0
+                level_time += (offset - previous_offset) * previous_level
+                cumulated.append((on_time, level_time))
+                previous_offset, previous_level = offset, level or 0
+            weekly = (on_time + ((WEEK_SECONDS - previous_offset) if previous_level else 0),
+                      level_time + (WEEK_SECONDS - previous_offset) * previous_level)
+            self._usage = transitions, cumulated, weekly
+        return self._usage
+
+    def _get_usage_since_week_start(self, week_start, moment):
+        (offsets, levels, _), cumulated, weekly = self._get_usage_table()
+        seconds = (moment - week_start).total_seconds()
+        weeks, seconds = divmod(seconds, WEEK_SECONDS)
+        k = bisect_right(offsets, seconds) - 1
+        if not offsets:
+            return 0, 0
+        # Before the first transition, the level is the one set by the last transition of the previous week.
+        level = levels[k] or 0
+        on_time, level_time = cumulated[k] if k >= 0 else (0, 0)
+        offset = offsets[k] if k >= 0 else 0
+        return (weeks * weekly[0] + on_time + ((seconds - offset) if level else 0),
+                weeks * weekly[1] + level_time + (seconds - offset) * level)
+
+    def get_usage(self, start, end):
+        """
+            Returns the tuple (on time, level time) of the schedule between the start and end datetimes, where on
+            time is the number of seconds at a level above 0 and level time the sum of the levels over each second.
+            It is computed from the weekly usage of the schedule, whatever the number of transitions in the range.
+        """
+        week_start = week_start_of(start)
+        end_on_time, end_level_time = self._get_usage_since_week_start(week_start, end)
+        start_on_time, start_level_time = self._get_usage_since_week_start(week_start, start)
+        return end_on_time - start_on_time, end_level_time - start_level_time
 
     def __repr__(self):
         return '%s(intervals=%s)' % (self.__class__.__qualname__, repr(self._intervals))
@@ -129,3 +267,145 @@ class Schedule(object):
                     else:
                         arrays[day].append([0, 96, interval.weight])
         return arrays
+
+
+class SlotSchedule(Schedule):
+    """
+        A schedule storing the level of each 15-minute slot of the week in an array of bytes, NO_LEVEL marking the
+        slots outside of any interval. Lookups are a single indexing and transitions are the runs of equal levels.
+        Slots are half-open: unlike a Schedule, the minute ending an interval belongs to the next slot.
+        Overlapping intervals are not merged: each slot keeps the level of the first interval covering it.
+
+        >>> s = SlotSchedule.from_interface_list([[4, 8, 1], [8, 12, 2]])
+        >>> s.get_weight(Instant(0, 1, 30)), s.get_weight(Instant(0, 3, 0))
+        (1, None)
+        >>> s
+        SlotSchedule(intervals=[[4, 8, 1], [8, 12, 2]])
+        >>> SlotSchedule.from_dict(s.to_dict()).to_dict() == s.to_dict()
+        True
+        >>> s.to_interface_list()[0]
+        [[4, 8, 1], [8, 12, 2]]
+    """
+
+    NO_LEVEL = 255
+
+    def __init__(self, intervals=None, levels=None):
+        self._levels = array('B', levels or bytes([self.NO_LEVEL]) * WEEK_SLOTS)
+        self._runs = None
+        self._dict = None
+        super().__init__(intervals)
+
+    @classmethod
+    def from_interface_list(cls, intervals):
+        """ Returns the schedule of the given list of [start, end, level] intervals of the week, in slots. """
+        levels = bytearray([cls.NO_LEVEL]) * WEEK_SLOTS
+        for a, b, level in reversed(intervals):
+            if not 0 <= a <= b <= WEEK_SLOTS or not 0 <= level < cls.NO_LEVEL:
+                raise ValueError('Invalid interval %r' % ([a, b, level],))
+            levels[a:b] = bytes([level]) * (b - a)
+        return cls(levels=levels)
+
+    def add_interval(self, new_interval: WeightedTimeInterval):
+        """
+            Sets the level of the free slots of the interval, whose bounds must fall on the start of a slot.
+            Raises a ValueError if the interval cannot be represented without loss.
+        """
+        self._ensure_modifiable()
+        a, b = self._to_slot(new_interval.a), self._to_slot(new_interval.b)
+        if not 0 <= new_interval.weight < self.NO_LEVEL:
+            raise ValueError('The weight of %r does not fit in a slot' % new_interval)
+        for slot in range(a, b):
+            if self._levels[slot] == self.NO_LEVEL:
+                self._levels[slot] = new_interval.weight
+            elif self._levels[slot] != new_interval.weight:
+                raise ValueError('%r overlaps an interval of another weight' % new_interval)
+        self._transitions = None
+        self._runs = None
+
+    @staticmethod
+    def _to_slot(i: Instant):
+        slot, remainder = divmod(week_offset(i), SLOT_SECONDS)
+        if remainder:
+            raise ValueError('%r does not fall on the start of a slot' % i)
+        return slot
+
+    def empty(self):
+        self._ensure_modifiable()
+        self._levels = array('B', bytes([self.NO_LEVEL]) * WEEK_SLOTS)
+        self._transitions = None
+        self._runs = None
+
+    def copy(self):
+        return SlotSchedule(levels=self._levels)
+
+    def get_weight(self, i: Instant):
+        level = self._levels[week_offset(i) // SLOT_SECONDS % WEEK_SLOTS]
+        return None if level == self.NO_LEVEL else level
+
+    def iter_runs(self):
+        """
+            Returns an iterator of the tuples (start, end, level) of the runs of slots of the same level, NO_LEVEL
+            included. The runs are computed once until the levels change, as they are needed to save the schedule.
+        """
+        if self._runs is None:
+            runs = []
+            start = 0
+            for level, run in groupby(self._levels):
+                end = start + len(tuple(run))
+                runs.append((start, end, level))
+                start = end
+            self._runs = runs
+        return iter(self._runs)
+
+    def _get_transitions(self):
+        """
+            Returns the transition table of the schedule, see Schedule._get_transitions.
+            A transition takes place at the start of each run. As intervals do not span over two weeks, the week starts
+            with a transition unless its first and last slots are both free.
+        """
+        if self._transitions is None:
+            offsets, levels = array('l'), []
+            for start, _, level in self.iter_runs():
+                if start or level != self.NO_LEVEL or self._levels[-1] != self.NO_LEVEL:
+                    offsets.append(start * SLOT_SECONDS)
+                    levels.append(None if level == self.NO_LEVEL else level)
+            self._transitions = (offsets, levels, [Instant.from_minutes(o // 60) for o in offsets])
+        return self._transitions
+
+    def __repr__(self):
+        return '%s(intervals=%s)' % (self.__class__.__qualname__,
+                                     [[a, b, level] for a, b, level in self.iter_runs() if level != self.NO_LEVEL])
+
+    def to_dict(self):
+        """ Returns the dict of the intervals of the schedule, built once until the levels change and not to modify. """
+        if self._dict is None or self._dict[0] is not self._runs:
+            intervals = [WeightedTimeInterval(Instant(minute=a * 15), Instant(minute=b * 15), level).to_dict()
+                         for a, b, level in self.iter_runs() if level != self.NO_LEVEL]
+            self._dict = self._runs, {'intervals': intervals}
+        return self._dict[1]
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Returns the schedule of the given dict, raising a ValueError if it cannot be represented without loss. """
+        schedule = cls()
+        for i in d['intervals']:
+            schedule.add_interval(WeightedTimeInterval.from_dict(i))
+        return schedule
+
+    def to_interface_list(self):
+        arrays = [[] for _ in range(7)]
+        for a, b, level in self.iter_runs():
+            if level == self.NO_LEVEL:
+                continue
+            for day in range(a // DAY_SLOTS, (b - 1) // DAY_SLOTS + 1):
+                day_start = day * DAY_SLOTS
+                arrays[day].append([max(a, day_start) - day_start, min(b, day_start + DAY_SLOTS) - day_start, level])
+        return arrays
+
+
+def load_schedule(d):
+    """ Returns the schedule of the given dict, as a SlotSchedule if it can be represented without loss. """
+    try:
+        return SlotSchedule.from_dict(d)
+    except ValueError:
+        return Schedule.from_dict(d)
@@ -4,68 +4,131 @@
 #
 
 
-from datetime import timedelta, date, datetime, time
+from datetime import timedelta, datetime
 
+from switch.time.clock import get_clock
 
-class Instant(timedelta):
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+
+def week_start_of(moment):
+    """ Returns the datetime of the midnight starting the week of the given datetime. """
+    day = moment.date()
+    return datetime.combine(day - timedelta(days=day.weekday()), datetime.min.time())
+
+
+class Instant(object):
     """ 
         A class representing an instant in a week with minute precision.  
         Days are automatically clamped for better interpretability of the results.
+        Instants are stored as their number of minutes since the start of the week, which is also their ordering key.
         
         >>> Instant(day=8, hour=2, minute=1)
         Instant(day=1, hour=2, minute=1)
+        >>> Instant(day=7) > Instant(day=6, hour=23, minute=59)
+        True
     """
 
-    def __new__(cls, day=0, hour=0, minute=0):
-        return super().__new__(cls, days=day % 8, hours=hour, minutes=minute)
+    __slots__ = ('minutes',)
+
+    # The start and the end of the current week as datetimes and timestamps, refreshed when the week is over.
+    _week = (datetime.min, datetime.min, 0, 0)
+
+    def __init__(self, day=0, hour=0, minute=0):
+        minutes = (day * 24 + hour) * 60 + minute
+        # The end of the week is kept as is, as it ends the intervals of the last day.
+        self.minutes = minutes % WEEK_MINUTES if minutes > WEEK_MINUTES else minutes
+
+    @classmethod
+    def from_minutes(cls, minutes):
+        """ Returns the instant at the given number of minutes since the start of the week, without clamping it. """
+        instant = object.__new__(cls)
+        instant.minutes = minutes
+        return instant
+
+    @property
+    def days(self):
+        return self.minutes // DAY_MINUTES
+
+    @property
+    def seconds(self):
+        return self.minutes % DAY_MINUTES * 60
 
     def __repr__(self):
         return '%s(day=%d, hour=%d, minute=%d)' % (
-            self.__class__.__qualname__, self.days, self.seconds // (60 * 60), (self.seconds // 60) % 60
+            self.__class__.__qualname__, self.minutes // DAY_MINUTES, self.minutes % DAY_MINUTES // 60,
+            self.minutes % 60
         )
 
+    def __eq__(self, other):
+        try:
+            return self.minutes == other.minutes
+        except AttributeError:
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(self.minutes)
+
     def __lt__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self < other.a
-        if isinstance(other, Instant):
-            return super().__lt__(other)
-        return NotImplemented
+        try:
+            return self.minutes < other.minutes
+        except AttributeError:
+            if isinstance(other, RelativeTimeInterval):
+                return self.minutes < other.start
+            return NotImplemented
 
     def __le__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self <= other.a
-        if isinstance(other, Instant):
-            return super().__le__(other)
-        return NotImplemented
+        try:
+            return self.minutes <= other.minutes
+        except AttributeError:
+            if isinstance(other, RelativeTimeInterval):
+                return self.minutes <= other.start
+            return NotImplemented
 
     def __gt__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self > other.b
-        if isinstance(other, Instant):
-            return super().__gt__(other)
-        return NotImplemented
+        try:
+            return self.minutes > other.minutes
+        except AttributeError:
+            if isinstance(other, RelativeTimeInterval):
+                return self.minutes > other.end
+            return NotImplemented
 
     def __ge__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self >= other.b
-        if isinstance(other, Instant):
-            return super().__ge__(other)
-        return NotImplemented
+        try:
+            return self.minutes >= other.minutes
+        except AttributeError:
+            if isinstance(other, RelativeTimeInterval):
+                return self.minutes >= other.end
+            return NotImplemented
 
     def to_datetime(self):
-        today = date.today()
-        week_start = datetime.combine(today - timedelta(days=today.weekday()), time())
-        return week_start + self
+        return self.get_week_start() + timedelta(minutes=self.minutes)
 
     def to_dict(self):
-        return {'day': self.days, 'hour': self.seconds // (60 * 60), 'minute': (self.seconds // 60) % 60}
+        return {'day': self.minutes // DAY_MINUTES, 'hour': self.minutes % DAY_MINUTES // 60,
+                'minute': self.minutes % 60}
+
+    @classmethod
+    def get_week_start(cls, now=None):
+        """ Returns the datetime of the start of the week of now, by default the current time of the clock. """
+        start, end, start_timestamp, end_timestamp = cls._week
+        if now is None:
+            clock = get_clock()
+            if start_timestamp <= clock.time() < end_timestamp:
+                return start
+            now = clock.now()
+        if not start <= now < end:
+            start = week_start_of(now)
+            end = start + timedelta(weeks=1)
+            Instant._week = start, end, start.timestamp(), end.timestamp()
+        return start
 
     @classmethod
     def now_to_instant(cls):
-        today = date.today()
-        week_start = datetime.combine(today - timedelta(days=today.weekday()), time())
-        delta = datetime.now() - week_start
-        return cls(day=delta.days, hour=delta.seconds // (60 * 60), minute=(delta.seconds // 60) % 60)
+        now = get_clock().now()
+        delta = now - cls.get_week_start(now)
+        return cls.from_minutes(delta.days * DAY_MINUTES + delta.seconds // 60)
 
     @classmethod
     def from_dict(cls, d):
@@ -91,37 +154,46 @@ class RelativeTimeInterval(object):
         False
     """
 
+    __slots__ = ('a', 'b', 'start', 'end')
+
     def __init__(self, a: Instant, b: Instant):
         assert a <= b
         self.a = a
         self.b = b
+        # The ordering keys of the bounds, in minutes since the start of the week.
+        self.start = a.minutes
+        self.end = b.minutes
 
     def __contains__(self, item):
         if isinstance(item, RelativeTimeInterval):
-            return self.a <= item.a and self.b >= item.b
+            return self.start <= item.start and self.end >= item.end
         if isinstance(item, Instant):
-            return self.a <= item <= self.b
+            return self.start <= item.minutes <= self.end
         return NotImplemented
 
     def __lt__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self.b < other.a
-        return NotImplemented
+        try:
+            return self.end < other.start
+        except AttributeError:
+            return NotImplemented
 
     def __le__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self.b <= other.a
-        return NotImplemented
+        try:
+            return self.end <= other.start
+        except AttributeError:
+            return NotImplemented
 
     def __gt__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self.a > other.b
-        return NotImplemented
+        try:
+            return self.start > other.end
+        except AttributeError:
+            return NotImplemented
 
     def __ge__(self, other):
-        if isinstance(other, RelativeTimeInterval):
-            return self.a >= other.b
-        return NotImplemented
+        try:
+            return self.start >= other.end
+        except AttributeError:
+            return NotImplemented
 
     def __repr__(self):
         return '%s(a=%s, b=%s)' % (self.__class__.__qualname__, repr(self.a), repr(self.b))
@@ -133,6 +205,8 @@ class WeightedTimeInterval(RelativeTimeInterval):
         Also adds dict dumping and loading.
     """
 
+    __slots__ = ('weight',)
+
     def __init__(self, a: Instant, b: Instant, w: int = 0):
         super().__init__(a, b)
         self.weight = w